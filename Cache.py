@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import fields
+
+from Models import Commodity, Category, Loop
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Cache')
+
+
+class CommodityCache:
+    """On disk copy of the commodity catalogue so startup doesn't have to wait for the network.
+
+    Commodities are stored as rows of values in the order of `fields` rather than one
+    object per commodity, which keeps the file small and quick to load.
+    """
+    VERSION = 1
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.etag = None
+        self.lastModified = None
+        self.fields = [field.name for field in fields(Commodity)]
+
+    def load(self):
+        """Returns a dict of id -> Commodity, empty if there is no usable cache"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as cacheFile:
+                data = json.load(cacheFile)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as err:
+            logger.warning(f'Unable to read commodity cache: {err}')
+            return {}
+
+        if data.get('version') != self.VERSION or data.get('fields') != self.fields:
+            logger.info('Commodity cache is from an older version, ignoring it')
+            return {}
+
+        commodities = {}
+        categoryIndx = self.fields.index('category')
+        for row in data['rows']:
+            if row[categoryIndx]:
+                row[categoryIndx] = Category(*row[categoryIndx])
+            commodity = Commodity(*row)
+            commodities[commodity.id] = commodity
+
+        self.etag = data.get('etag')
+        self.lastModified = data.get('lastModified')
+        return commodities
+
+    def save(self, commodities, etag=None, lastModified=None):
+        rows = []
+        for commodity in commodities:
+            row = [getattr(commodity, name) for name in self.fields]
+            category = commodity.category
+            row[self.fields.index('category')] = [category.id, category.name] if category else None
+            rows.append(row)
+
+        data = {
+            'version': self.VERSION,
+            'etag': etag,
+            'lastModified': lastModified,
+            'fields': self.fields,
+            'rows': rows
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmpPath = f'{self.path}.tmp'
+        with open(tmpPath, 'w', encoding='utf-8') as cacheFile:
+            json.dump(data, cacheFile, separators=(',', ':'))
+        os.replace(tmpPath, self.path) # never leave a half written cache behind
+        self.etag = etag
+        self.lastModified = lastModified
+
+    def headers(self):
+        """Conditional request headers so an unchanged catalogue comes back as a 304"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastModified:
+            headers['If-Modified-Since'] = self.lastModified
+        return headers
+
+
+class LoopCache:
+    """Recent loop search results keyed on the search settings.
+
+    Results are fresh for `ttl` seconds (never longer than the search's price age), after
+    which they are still returned for up to `maxStale` seconds but flagged as stale so the
+    caller can show them straight away and refresh them in the background. The least
+    recently used searches are dropped once there are more than `maxEntries`. Results are
+    written to `path` if one is given so they survive a restart, at most every
+    `saveInterval` seconds while searches are being stored and by `save` on shutdown.
+    """
+    VERSION = 1
+
+    def __init__(self, ttl=300, maxStale=3600, maxEntries=32, path=None, saveInterval=60) -> None:
+        self.ttl = ttl
+        self.maxStale = maxStale
+        self.maxEntries = maxEntries
+        self.path = path
+        self.saveInterval = saveInterval
+        self.entries = OrderedDict()  # key -> (time stored, loops)
+        self.lock = threading.Lock()
+        self.saveLock = threading.Lock()  # held from writing the tmp file until it replaces the cache
+        self.dirty = False  # entries changed since the last save
+        self.savedAt = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(params):
+        """Normalise search settings so equivalent searches share an entry"""
+        return tuple(sorted((name, round(value, 3) if isinstance(value, float) else value) for name, value in params.items()))
+
+    def get(self, key, priceAge):
+        """Returns (loops, isFresh) or None if there's nothing usable cached"""
+        now = time.time()
+        ttl = min(self.ttl, priceAge * 86400)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now - entry[0] > ttl + self.maxStale:
+                self.misses = self.misses + 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return entry[1], now - entry[0] <= ttl
+
+    def put(self, key, loops):
+        with self.lock:
+            self.entries[key] = (time.time(), list(loops))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+        if self.path and time.monotonic() - self.savedAt >= self.saveInterval:
+            self.save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.dirty = True
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as cacheFile:
+                data = json.load(cacheFile)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            logger.warning(f'Unable to read loop cache: {err}')
+            return
+        if data.get('version') != self.VERSION:
+            return
+        with self.lock:
+            for key, stored, loops in data['entries']:
+                key = tuple(tuple(param) for param in key)
+                self.entries[key] = (stored, [Loop(**loop) for loop in loops])
+        logger.info(f'Loaded {len(self.entries)} cached loop searches')
+
+    def save(self):
+        """Write the entries to `path` if they changed since the last save, safe to call from any thread"""
+        if not self.path:
+            return
+        with self.saveLock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                entries = [[key, stored, [loop.raw() for loop in loops]] for key, (stored, loops) in self.entries.items()]
+                self.dirty = False
+                self.savedAt = time.monotonic()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmpPath = f'{self.path}.tmp'
+            try:
+                with open(tmpPath, 'w', encoding='utf-8') as cacheFile:
+                    json.dump({'version': self.VERSION, 'entries': entries}, cacheFile, separators=(',', ':'))
+                os.replace(tmpPath, self.path)
+            except OSError as err:
+                self.dirty = True  # try again next time
+                logger.warning(f'Unable to write loop cache: {err}')
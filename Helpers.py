@@ -1,38 +1,143 @@
+import json
+import time
+import queue
+import codecs
 import threading
+import collections
 
 
-# https://www.kite.com/python/examples/4023/threading-wait-for-either-of-two-events-to-be-set
-# Define versions of set and clear that trigger a "change" callback
-def or_set(self):
-    self._set()
-    self.changed()
-
-def or_clear(self):
-    self._clear()
-    self.changed()
-
-# Make sets and clears trigger a "changed" callback that notifies an OrEvent
-# of a change. Copy original "set" and "clear" so they can still be called.
-def orify(event, changed_callback):
-    event._set = event.set
-    event._clear = event.clear
-    event.changed = changed_callback
-    event.set = lambda: or_set(event)
-    event.clear = lambda: or_clear(event)
-
-# Create a unified OrEvent from a list of regular events
-def OrEvent(*events):
-    or_event = threading.Event()
-    # any time a constituent event is set or cleared, update this one
-    def changed():
-        bools = [event.is_set() for event in events]
-        if any(bools):
-            or_event.set()
-        else:
-            or_event.clear()
-    for event in events:
-        orify(event, changed)
-
-    # initialize
-    changed()
-    return or_event
\ No newline at end of file
+class SearchScheduler:
+    """Hands search jobs from the UI to a worker thread.
+
+    Jobs submitted while the worker is busy are coalesced so only the newest one runs,
+    and every job gets a generation number so a running search can check whether it has
+    been superseded and drop its results.
+    """
+    STOP = object()
+
+    def __init__(self) -> None:
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def submit(self, job):
+        """Queue a job, returns its generation"""
+        with self.lock:
+            self.generation = self.generation + 1
+            generation = self.generation
+        self.queue.put((generation, job))
+        return generation
+
+    def stop(self):
+        self.queue.put(self.STOP)
+
+    def isCurrent(self, generation):
+        return generation == self.generation
+
+    def next(self):
+        """Blocks until there is a job, returns (generation, job) for the newest one or None once stopped"""
+        item = self.queue.get()
+        while item is not self.STOP:
+            try:
+                newer = self.queue.get_nowait()
+            except queue.Empty:
+                return item
+            item = newer
+        return None
+
+
+class Prefetcher:
+    """Low priority background jobs with a bounded budget.
+
+    Only the newest `maxQueued` jobs are kept waiting, a key that was run in the last
+    `window` seconds is not run again, and at most `budget` jobs run per `window`.
+    """
+
+    def __init__(self, maxQueued=2, budget=10, window=600) -> None:
+        self.maxQueued = maxQueued
+        self.budget = budget
+        self.window = window
+        self.jobs = collections.OrderedDict()  # key -> job
+        self.started = collections.OrderedDict()  # key -> time it was run
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    def submit(self, key, job):
+        """Queue a job unless its key ran recently, returns whether it was queued"""
+        with self.condition:
+            self.expire()
+            if key in self.started:
+                return False
+            self.jobs.pop(key, None)
+            self.jobs[key] = job
+            while len(self.jobs) > self.maxQueued:
+                self.jobs.popitem(last=False)  # the oldest target is the least likely to be needed
+            self.condition.notify()
+            return True
+
+    def expire(self):
+        cutoff = time.monotonic() - self.window
+        while self.started and next(iter(self.started.values())) < cutoff:
+            self.started.popitem(last=False)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def next(self):
+        """Blocks until there is a job and budget to run it, returns (key, job) or None once stopped"""
+        with self.condition:
+            while not self.stopped:
+                self.expire()
+                if self.jobs and len(self.started) < self.budget:
+                    key, job = self.jobs.popitem()
+                    self.started[key] = time.monotonic()
+                    return key, job
+                # wait for a job, or for the oldest run to leave the window
+                self.condition.wait(self.window / 10 if self.jobs else None)
+            return None
+
+
+def iterJsonArray(chunks):
+    """Yield the items of a top level json array while its bytes are still arriving.
+
+    Only the unparsed tail of the stream is kept in memory, so memory use is bounded by
+    the chunk size plus the largest single item rather than the size of the response.
+    """
+    decoder = json.JSONDecoder()
+    textDecoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer = buffer + textDecoder.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos = pos + 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Expected a json array')
+                started = True
+                pos = pos + 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # item is incomplete, wait for the next chunk
+            if not isinstance(item, (dict, list, str)):
+                # a number or literal is only whole once a ',' or ']' follows it, '2.' decodes as 2
+                after = end
+                while after < len(buffer) and buffer[after] in ' \t\r\n':
+                    after = after + 1
+                if after == len(buffer) or buffer[after] not in ',]':
+                    break
+            yield item
+            pos = end
+        buffer = buffer[pos:]
+    if not started or buffer.strip():
+        raise ValueError('Json array ended unexpectedly')
@@ -0,0 +1,222 @@
+"""Bulk import of full data dumps into the plugin's market store.
+
+Run with a normal Python from the plugin folder while EDMC is closed:
+
+    python Import.py systems_populated.jsonl stations.jsonl listings.csv
+    python Import.py --store cache/market.db --workers 8 listings.csv
+
+Files can be json lines or csv with a header row, the kind of data is taken from the file
+name unless --kind is given. Each file is split into chunks that are parsed in parallel
+by a pool of processes while the parsed rows are written to the store. Finished chunks
+are recorded next to the store, so running the same command again after an interrupted
+import carries on where it stopped.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+import concurrent.futures
+from dataclasses import fields
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+try:
+    import EDMCLogging  # only there when running inside EDMC
+except ImportError:
+    sys.path.append(os.path.join(HERE, 'benchmarks', 'stubs'))
+
+from Models import System, Station, Commodity, Listing
+from Store import MarketStore, SYSTEM_COLUMNS, STATION_COLUMNS, COMMODITY_COLUMNS, LISTING_COLUMNS
+
+logger = logging.getLogger('EDMC-Trade-Tracker.Import')
+
+CHUNK_SIZE = 8 * 1024 * 1024  # bytes of dump per parsing job
+
+# kind -> (table, columns, model, conflict), in the order they are imported
+KINDS = {
+    'commodities': ('commodities', COMMODITY_COLUMNS, Commodity, 'id'),
+    'systems': ('systems', SYSTEM_COLUMNS, System, 'id'),
+    'stations': ('stations', STATION_COLUMNS, Station, 'id'),
+    'listings': ('listings', LISTING_COLUMNS, Listing, 'station_id, commodity_id')
+}
+
+
+def kindOf(path):
+    name = os.path.basename(path).lower()
+    return next((kind for kind in KINDS if kind in name), None)
+
+
+def columnTypes(kind):
+    table, columns, modelClass, conflict = KINDS[kind]
+    types = {field.name: field.type for field in fields(modelClass)}
+    return [types.get(column, str) for column in columns]
+
+
+def convert(value, valueType):
+    """A csv string or json value as the column's type"""
+    if value is None or value == '':
+        return None
+    if valueType is bool:
+        return value if isinstance(value, bool) else str(value).lower() in ('1', 'true')
+    if valueType is int:
+        return value if isinstance(value, int) else int(float(value))
+    if valueType is float:
+        return float(value)
+    return value
+
+
+def chunks(path, chunkSize=CHUNK_SIZE):
+    """(start, end) byte ranges covering the file, parseChunk moves them to line boundaries"""
+    size = os.path.getsize(path)
+    return [(start, min(start + chunkSize, size)) for start in range(0, size, chunkSize)]
+
+
+def readLines(path, start, end):
+    """Lines that start within [start, end), the line a chunk starts inside belongs to the chunk before"""
+    with open(path, 'rb') as dumpFile:
+        if start > 0:
+            dumpFile.seek(start - 1)
+            dumpFile.readline()
+        pos = dumpFile.tell()
+        while pos < end:
+            line = dumpFile.readline()
+            if not line:
+                break
+            pos = pos + len(line)
+            yield line
+
+
+def parseChunk(path, start, end, kind, header=None):
+    """Rows of one chunk as value lists in the store's column order, runs in a worker process.
+
+    `header` is the csv header row, None for json lines.
+    """
+    table, columns, modelClass, conflict = KINDS[kind]
+    types = columnTypes(kind)
+    lines = readLines(path, start, end)
+    if header is None:
+        records = (json.loads(line) for line in lines if line.strip())
+    else:
+        if start == 0:
+            next(lines, None)  # the header row
+        records = csv.DictReader((line.decode('utf-8') for line in lines), fieldnames=header)
+    rows = []
+    for record in records:
+        if kind == 'commodities' and 'category_name' not in record:
+            record['category_name'] = (record.get('category') or {}).get('name')
+        rows.append([convert(record.get(column), valueType) for column, valueType in zip(columns, types)])
+    return rows
+
+
+class ImportProgress:
+    """Which chunks of which dump files are in the store, saved after every chunk"""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.files = dict()  # dump path -> {'size', 'mtime', 'done': [chunk starts]}
+        try:
+            with open(path, 'r', encoding='utf-8') as progressFile:
+                self.files = json.load(progressFile)
+        except (OSError, ValueError):
+            pass
+
+    def done(self, dumpPath):
+        """Chunk starts already imported from the file, empty if the file changed since"""
+        stat = os.stat(dumpPath)
+        entry = self.files.get(os.path.abspath(dumpPath))
+        if not entry or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            self.files[os.path.abspath(dumpPath)] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'done': []}
+            return set()
+        return set(entry['done'])
+
+    def markDone(self, dumpPath, start):
+        self.files[os.path.abspath(dumpPath)]['done'].append(start)
+        self.save()
+
+    def finish(self, dumpPath):
+        self.files.pop(os.path.abspath(dumpPath), None)
+        self.save()
+
+    def save(self):
+        tmpPath = f'{self.path}.tmp'
+        with open(tmpPath, 'w', encoding='utf-8') as progressFile:
+            json.dump(self.files, progressFile)
+        os.replace(tmpPath, self.path)
+
+
+def printProgress(kind, doneBytes, totalBytes, rows, started):
+    rate = rows / max(time.perf_counter() - started, 1e-6)
+    print(f'\r{kind}: {doneBytes * 100 // max(totalBytes, 1)}% {rows} rows ({rate:.0f} rows/s)', end='', flush=True)
+
+
+def importFile(store, path, kind, executor, progress, workers, onProgress=printProgress):
+    """Parse a dump in parallel and write it to the store, returns the number of rows written"""
+    table, columns, modelClass, conflict = KINDS[kind]
+    header = None
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8', newline='') as dumpFile:
+            header = next(csv.reader(dumpFile))
+    done = progress.done(path)
+    pending = [chunk for chunk in chunks(path) if chunk[0] not in done]
+    totalBytes = os.path.getsize(path)
+    doneBytes = totalBytes - sum(end - start for start, end in pending)
+    if done:
+        print(f'Resuming {path}, {len(done)} chunks were already imported')
+    rows = 0
+    started = time.perf_counter()
+    running = dict()  # future -> chunk
+    while pending or running:
+        while pending and len(running) < workers * 2:  # bounds the parsed rows held in memory
+            start, end = pending.pop(0)
+            running[executor.submit(parseChunk, path, start, end, kind, header)] = (start, end)
+        finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+            start, end = running.pop(future)
+            rows = rows + store.upsertValues(table, columns, future.result(), conflict)
+            progress.markDone(path, start)
+            doneBytes = doneBytes + end - start
+            onProgress(kind, doneBytes, totalBytes, rows, started)
+    progress.finish(path)
+    print()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help='json lines or csv dumps')
+    parser.add_argument('--store', default=os.path.join(HERE, 'cache', 'market.db'))
+    parser.add_argument('--kind', choices=KINDS, help='kind of data in every file, by default from the file names')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--restart', action='store_true', help='ignore the progress of an interrupted import')
+    args = parser.parse_args()
+
+    kinds = {path: args.kind or kindOf(path) for path in args.files}
+    unknown = [path for path, kind in kinds.items() if kind is None]
+    if unknown:
+        parser.error(f'Unable to tell what is in {", ".join(unknown)}, use --kind')
+
+    store = MarketStore(args.store)
+    progress = ImportProgress(f'{args.store}.import.json')
+    if args.restart:
+        progress.files.clear()
+    order = sorted(args.files, key=lambda path: list(KINDS).index(kinds[path]))
+    started = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor, store.bulkWrites():
+        total = sum(importFile(store, path, kinds[path], executor, progress, args.workers) for path in order)
+    print(f'Imported {total} rows in {time.perf_counter() - started:.1f}s')
+    for kind in set(kinds.values()):
+        store.markImported(kind, round(time.time()))  # the plugin only trusts the store to cover an area after this
+
+    if any(kinds[path] in ('systems', 'stations') for path in order):
+        store.mergeLocalRows()  # systems and stations only the journal knew may be in the dump now
+        snapshotPath = os.path.join(os.path.dirname(os.path.abspath(args.store)), 'systems.snapshot')
+        try:
+            store.writeSnapshot(snapshotPath)
+        except OSError as err:
+            print(f'Unable to write the snapshot, EDMC will write it on its next start: {err}')
+
+
+if __name__ == '__main__':
+    main()
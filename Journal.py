@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime, timezone
+
+from Models import System, Station, Listing
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Journal')
+
+# journal StationType -> eddb station type_id
+STATION_TYPES = {
+    'Outpost': 12,
+    'Coriolis': 3,
+    'Ocellus': 7,
+    'Bernal': 7,
+    'Orbis': 8,
+    'CraterOutpost': 13,
+    'CraterPort': 14,
+    'OnFootSettlement': 16,
+    'MegaShip': 19,
+    'AsteroidBase': 20,
+    'FleetCarrier': 24
+}
+
+# Station model field -> journal StationServices name
+STATION_SERVICES = {
+    'has_blackmarket': 'blackmarket',
+    'has_refuel': 'refuel',
+    'has_repair': 'repair',
+    'has_rearm': 'rearm',
+    'has_outfitting': 'outfitting',
+    'has_shipyard': 'shipyard',
+    'has_docking': 'dock',
+    'has_commodities': 'commodities',
+    'has_material_trader': 'materialtrader',
+    'has_technology_broker': 'techBroker',
+    'has_carrier_vendor': 'carriervendor',
+    'has_carrier_administration': 'carriermanagement',
+    'has_interstellar_factors': 'facilitator',
+    'has_universal_cartographics': 'exploration',
+    'has_social_space': 'socialspace'
+}
+
+
+def entryTime(entry):
+    """Journal timestamps as unix time, now if the entry doesn't have one"""
+    try:
+        return round(datetime.strptime(entry['timestamp'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp())
+    except (KeyError, ValueError):
+        return round(time.time())
+
+
+def systemFromEntry(entry, systemId):
+    """System model from a Location or FSDJump event, `systemId` is its eddb id or a Store.localId"""
+    x, y, z = entry['StarPos']
+    population = entry.get('Population', 0)
+    return System(
+        id=systemId,
+        name=entry['StarSystem'],
+        x=x,
+        y=y,
+        z=z,
+        faction=entry.get('SystemFaction', {}).get('Name', ''),
+        population=population,
+        allegiance_id=0,
+        government_id=0,
+        needs_permit=False,
+        updated_at=entryTime(entry),
+        simbad_ref='',
+        is_populated=population > 0,
+        ed_system_address=entry.get('SystemAddress')
+    )
+
+
+def stationFromEntry(entry, systemId, stationId):
+    """Station model from a Docked event (or a Location event while docked), `stationId` is its eddb id or a Store.localId"""
+    pads = entry.get('LandingPads', {})
+    if pads.get('Large'):
+        padSize = 'L'
+    elif pads.get('Medium'):
+        padSize = 'M'
+    else:
+        padSize = 'S'
+    services = set(entry.get('StationServices', ()))
+    updated = entryTime(entry)
+    return Station(
+        id=stationId,
+        name=entry['StationName'],
+        system_id=systemId,
+        max_landing_pad_size=padSize,
+        distance_to_star=round(entry.get('DistFromStarLS', 0)),
+        faction=entry.get('StationFaction', {}).get('Name', ''),
+        type_id=STATION_TYPES.get(entry.get('StationType'), 12),
+        updated_at=updated,
+        shipyard_updated_at=updated,
+        outfitting_updated_at=updated,
+        market_updated_at=updated,
+        ed_market_id=entry['MarketID'],
+        **{field: service in services for field, service in STATION_SERVICES.items()}
+    )
+
+
+def readMarket(journalDir):
+    """Contents of Market.json, None if it can't be read"""
+    try:
+        with open(os.path.join(journalDir, 'Market.json'), 'r', encoding='utf-8') as marketFile:
+            return json.load(marketFile)
+    except (OSError, ValueError) as err:
+        logger.warning(f'Unable to read Market.json: {err}')
+        return None
+
+
+def readNavRoute(journalDir):
+    """Systems on the plotted route from NavRoute.json, starting with the one it was plotted from"""
+    try:
+        with open(os.path.join(journalDir, 'NavRoute.json'), 'r', encoding='utf-8') as routeFile:
+            return json.load(routeFile).get('Route', [])
+    except (OSError, ValueError) as err:
+        logger.warning(f'Unable to read NavRoute.json: {err}')
+        return []
+
+
+def listingsFromMarket(market, stationId, commodities):
+    """Listing models for every commodity in a Market.json that we know the commodity of.
+
+    `commodities` is a CommodityLookup. The listings have no id yet, the store they are
+    added to gives them one.
+    """
+    collectedAt = entryTime(market)
+    listings = []
+    for item in market.get('Items', ()):
+        commodity = commodities.resolve(item.get('id'), item.get('Name'), item.get('Name_Localised'))
+        if commodity is None:
+            continue
+        listings.append(Listing(
+            id=None,
+            station_id=stationId,
+            commodity_id=commodity.id,
+            supply=item.get('Stock', 0),
+            supply_bracket=item.get('StockBracket', 0),
+            buy_price=item.get('BuyPrice', 0),
+            sell_price=item.get('SellPrice', 0),
+            demand=item.get('Demand', 0),
+            demand_bracket=item.get('DemandBracket', 0),
+            collected_at=collectedAt
+        ))
+    return listings
@@ -0,0 +1,84 @@
+import sys
+import logging
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Lookup')
+
+
+def normalizeName(name):
+    """Lower case letters and digits only, interned so equal names share one string"""
+    return sys.intern(''.join(char for char in (name or '').lower() if char.isalnum()))
+
+
+def symbolKey(symbol):
+    """Journal commodity symbols come as '$gold_name;' in Market.json and 'gold' in MarketBuy"""
+    symbol = (symbol or '').lower()
+    if symbol.startswith('$') and symbol.endswith('_name;'):
+        symbol = symbol[1:-len('_name;')]
+    return normalizeName(symbol)
+
+
+class CommodityLookup:
+    """Resolves the ways journal events name a commodity to the catalogue's Commodity.
+
+    Built once from the catalogue and replaced whenever the catalogue is refreshed. Symbols
+    start out as the normalised names and are corrected from every Market.json seen, since
+    that pairs each symbol with the game's commodity id.
+    """
+
+    def __init__(self, commodities=()) -> None:
+        self.byEdId = dict()
+        self.byName = dict()
+        self.bySymbol = dict()
+        for commodity in commodities:
+            self.byEdId[commodity.ed_id] = commodity
+            self.byName[normalizeName(commodity.name)] = commodity
+        self.bySymbol.update(self.byName)
+
+    def __len__(self):
+        return len(self.byEdId)
+
+    def resolve(self, edId=None, symbol=None, name=None):
+        """The Commodity for whichever identifiers an event has, None if none of them are known"""
+        commodity = self.byEdId.get(edId) if edId is not None else None
+        if commodity is None and symbol:
+            commodity = self.bySymbol.get(symbolKey(symbol))
+        if commodity is None and name:
+            commodity = self.byName.get(normalizeName(name))
+        return commodity
+
+    def learnMarket(self, market):
+        """Record the symbols used in a Market.json"""
+        for item in market.get('Items', ()):
+            commodity = self.byEdId.get(item.get('id'))
+            if commodity and item.get('Name'):
+                self.bySymbol[symbolKey(item['Name'])] = commodity
+
+
+class StationLookup:
+    """Station ids by the game's MarketID and by system and station name.
+
+    Built from the store when the plugin starts and kept up to date as stations are
+    docked at, so resolving a Docked event never needs a query.
+    """
+
+    def __init__(self, rows=()) -> None:
+        self.byMarketId = dict()
+        self.byName = dict()
+        for row in rows:
+            self.add(row['id'], row.get('ed_market_id'), row['system_name'], row['name'])
+
+    def __len__(self):
+        return len(self.byName)
+
+    def add(self, stationId, marketId, systemName, stationName):
+        if marketId:
+            self.byMarketId[marketId] = stationId
+        self.byName[(normalizeName(systemName), normalizeName(stationName))] = stationId
+
+    def find(self, marketId=None, systemName=None, stationName=None):
+        """The station's id, None if it isn't known"""
+        stationId = self.byMarketId.get(marketId) if marketId else None
+        if stationId is None and systemName and stationName:
+            stationId = self.byName.get((normalizeName(systemName), normalizeName(stationName)))
+        return stationId
@@ -0,0 +1,91 @@
+import time
+import logging
+import threading
+from collections import deque, Counter
+from contextlib import contextmanager
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Metrics')
+
+
+class Metrics:
+    """Timing spans and counters for the plugin's hot paths.
+
+    Each span name keeps its last `size` durations in a ring buffer, so recording costs a
+    deque append and memory use doesn't grow. Percentiles are only worked out on request.
+    """
+
+    def __init__(self, size=256) -> None:
+        self.size = size
+        self.spans = dict()  # name -> deque of seconds
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        durations = self.spans.get(name)
+        if durations is None:
+            with self.lock:
+                durations = self.spans.setdefault(name, deque(maxlen=self.size))
+        durations.append(seconds)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def countBytes(self, name, chunks):
+        """Pass chunks through, counting their size"""
+        for chunk in chunks:
+            self.count(name, len(chunk))
+            yield chunk
+
+    @staticmethod
+    def percentile(values, fraction):
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        """{span name: (samples, p50 seconds, p95 seconds)}"""
+        with self.lock:
+            spans = {name: list(durations) for name, durations in self.spans.items()}
+        return {name: (len(durations), self.percentile(durations, 0.5), self.percentile(durations, 0.95))
+                for name, durations in spans.items() if durations}
+
+    def summaryText(self):
+        spans = ', '.join(f'{name} p50={p50 * 1000:.1f}ms p95={p95 * 1000:.1f}ms'
+                          for name, (samples, p50, p95) in sorted(self.summary().items()))
+        with self.lock:
+            counters = ', '.join(f'{name}={value}' for name, value in sorted(self.counters.items()))
+        return f'{spans}; {counters}'
+
+    def logSummary(self):
+        logger.info(f'Timings: {self.summaryText()}')
+
+
+class Stopwatch:
+    """Adds up the time an iterator spends producing its items, not the time spent using them"""
+
+    def __init__(self) -> None:
+        self.seconds = 0
+
+    def wrap(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.seconds = self.seconds + time.perf_counter() - start
+            yield item
+
+
+metrics = Metrics()  # shared by every module
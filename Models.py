@@ -1,7 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict, is_dataclass
 import tkinter as tk
 import time
 import math
+import heapq
+from operator import attrgetter
 from functools import partial
 from tkinter import ttk
 
@@ -53,10 +55,11 @@ class Listing:
     LEFT: str = "Left"
     RIGHT: str = "RIGHT"
 
-    def timeAgo(self): # changeto datetime.timedelta
-        now = round(time.time())
-        listingTime = self.collected_at
-        timeDiff = now - listingTime
+    def age(self, now=None):
+        return round(time.time() if now is None else now) - self.collected_at
+
+    def timeAgo(self, now=None): # changeto datetime.timedelta
+        timeDiff = self.age(now)
 
         if timeDiff < 60: #
             return f"{timeDiff}sec "
@@ -67,6 +70,12 @@ class Listing:
         else:
             return f"{round(timeDiff/60/60/24)}day"
 
+    def nextTimeAgo(self, now=None):
+        """Seconds until timeAgo() could show something different, the rounding only changes on these steps"""
+        timeDiff = self.age(now)
+        step = 1 if timeDiff < 60 else 30 if timeDiff < 3600 else 1800 if timeDiff < 86400 else 43200
+        return step - timeDiff % step
+
 
 @dataclass
 class BuyListing(Listing):
@@ -104,6 +113,7 @@ class Station:
     shipyard_updated_at: int
     outfitting_updated_at: int
     market_updated_at: int
+    ed_market_id: int = None
 
     def getTypeIcon(self):
         if self.type_id in range(13, 18):
@@ -126,6 +136,11 @@ class System:
     updated_at: int
     simbad_ref: str
     is_populated: bool
+    ed_system_address: int = None  # the game's SystemAddress, once we've been there
+
+def rawValue(value, name):
+    """Reads a field from either the raw json dict or the model built from it"""
+    return value[name] if isinstance(value, dict) else getattr(value, name)
 
 @dataclass
 class Point:
@@ -134,49 +149,98 @@ class Point:
     z: float
 
     def distance(self, point):
-        dx = self.x - point.x
-        dy = self.y - point.y
-        dz = self.z - point.z
-        return round(math.hypot(dx, dy, dz))
+        return round(math.dist((self.x, self.y, self.z), (point.x, point.y, point.z)))
+
+
+class LazyModel:
+    """Loop field that is kept as raw json until it is first read, then built into its model"""
+    def __init__(self, modelClass):
+        self.modelClass = modelClass
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, loop, owner=None):
+        if loop is None:
+            return self
+        value = loop.fields[self.name]
+        if not isinstance(value, self.modelClass):
+            value = self.modelClass(**value)
+            loop.fields[self.name] = value
+        return value
+
+    def __set__(self, loop, value):
+        loop.fields[self.name] = value
 
 
-@dataclass
 class Loop:
-    oneBuyListing: BuyListing
-    twoBuyListing: BuyListing
-    oneSellListing: SellListing
-    twoSellListing: SellListing
-    oneStation: Station
-    twoStation: Station
-    oneSystem: System
-    twoSystem: System
-    oneCommodity: Commodity
-    twoCommodity: Commodity
-    distance: float
-    userSystem: System
-    tradeLoopId: int
+    """A two station trade loop.
 
-    def __post_init__(self):
-        self.oneBuyListing = BuyListing(**self.oneBuyListing)
-        self.twoBuyListing = BuyListing(**self.twoBuyListing)
-        self.oneSellListing = SellListing(**self.oneSellListing)
-        self.twoSellListing = SellListing(**self.twoSellListing)
-        self.oneStation = Station(**self.oneStation)
-        self.twoStation = Station(**self.twoStation)
-        self.oneSystem = System(**self.oneSystem)
-        self.twoSystem = System(**self.twoSystem)
-        self.oneCommodity = Commodity(**self.oneCommodity)
-        self.twoCommodity = Commodity(**self.twoCommodity)
-        self.userSystem = System(**self.userSystem)
-        self.distance = round(self.distance)
+    Only the values needed for ranking are read from the json up front, the nested
+    listings, stations, systems and commodities are built on first access.
+    """
+    __slots__ = ('fields', 'distance', 'tradeLoopId', 'profitValue', 'supply', 'collectedAt', 'minDistance',
+                 'lapProfit', 'hourProfit')
+
+    oneBuyListing = LazyModel(BuyListing)
+    twoBuyListing = LazyModel(BuyListing)
+    oneSellListing = LazyModel(SellListing)
+    twoSellListing = LazyModel(SellListing)
+    oneStation = LazyModel(Station)
+    twoStation = LazyModel(Station)
+    oneSystem = LazyModel(System)
+    twoSystem = LazyModel(System)
+    oneCommodity = LazyModel(Commodity)
+    twoCommodity = LazyModel(Commodity)
+    userSystem = LazyModel(System)
+
+    def __init__(self, oneBuyListing, twoBuyListing, oneSellListing, twoSellListing, oneStation, twoStation,
+                 oneSystem, twoSystem, oneCommodity, twoCommodity, distance, userSystem, tradeLoopId):
+        self.fields = {
+            'oneBuyListing': oneBuyListing,
+            'twoBuyListing': twoBuyListing,
+            'oneSellListing': oneSellListing,
+            'twoSellListing': twoSellListing,
+            'oneStation': oneStation,
+            'twoStation': twoStation,
+            'oneSystem': oneSystem,
+            'twoSystem': twoSystem,
+            'oneCommodity': oneCommodity,
+            'twoCommodity': twoCommodity,
+            'userSystem': userSystem
+        }
+        self.distance = round(distance)
+        self.tradeLoopId = tradeLoopId
+        oneProfit = rawValue(twoSellListing, 'sell_price') - rawValue(oneBuyListing, 'buy_price')
+        twoProfit = rawValue(oneSellListing, 'sell_price') - rawValue(twoBuyListing, 'buy_price')
+        self.profitValue = oneProfit + twoProfit
+        self.supply = min(rawValue(oneBuyListing, 'supply'), rawValue(twoBuyListing, 'supply'))
+        self.collectedAt = min(rawValue(listing, 'collected_at') for listing in (oneBuyListing, twoBuyListing, oneSellListing, twoSellListing))
+        self.minDistance = None  # worked out when first needed, it's a sort key
+        self.lapProfit = 0  # expected for the commander's ship, set by Scoring.LoopScores
+        self.hourProfit = 0
+
+    def raw(self):
+        """The loop as json data, the inverse of Loop(**data)"""
+        raw = {name: asdict(value) if is_dataclass(value) else value for name, value in self.fields.items()}
+        raw['distance'] = self.distance
+        raw['tradeLoopId'] = self.tradeLoopId
+        return raw
+
+    def __repr__(self):
+        return f'Loop(tradeLoopId={self.tradeLoopId}, profit={self.profitValue}, distance={self.distance})'
+
+    def systemPoint(self, name):
+        system = self.fields[name]
+        return (rawValue(system, 'x'), rawValue(system, 'y'), rawValue(system, 'z'))
 
     def min_distance(self):
-        userPoint = Point(self.userSystem.x, self.userSystem.y, self.userSystem.z)
-        oneSystemPoint = Point(self.oneSystem.x, self.oneSystem.y, self.oneSystem.z)
-        twoSystemPoint = Point(self.twoSystem.x, self.twoSystem.y, self.twoSystem.z)
-        dist1 = userPoint.distance(oneSystemPoint)
-        dist2 = userPoint.distance(twoSystemPoint)
-        return min(dist1, dist2)
+        if self.minDistance is None:
+            userPoint = self.systemPoint('userSystem')
+            dist1 = math.dist(userPoint, self.systemPoint('oneSystem'))
+            dist2 = math.dist(userPoint, self.systemPoint('twoSystem'))
+            self.minDistance = round(min(dist1, dist2))
+        return self.minDistance
     
     def min_distance_str(self):
         return f'{self.min_distance()} ly'
@@ -185,13 +249,61 @@ class Loop:
         return f'{self.distance} ly'
 
     def profit(self):
-        oneProfit = self.twoSellListing.sell_price - self.oneBuyListing.buy_price
-        twoProfit = self.oneSellListing.sell_price - self.twoBuyListing.buy_price
-        return oneProfit + twoProfit
+        return self.profitValue
     
     def profit_str(self):
         return f'{self.profit()}Cr'
 
+    def profit_per_ly(self):
+        return self.profitValue / max(self.distance, 1)
+
+    def route(self):
+        """The loop as two Route stops, buying at each station for the other one"""
+        return [
+            Route(self.oneSystem, self.oneStation, self.oneCommodity, self.oneBuyListing.supply, self.oneBuyListing.buy_price,
+                  self.twoSellListing.sell_price - self.oneBuyListing.buy_price, self.distance),
+            Route(self.twoSystem, self.twoStation, self.twoCommodity, self.twoBuyListing.supply, self.twoBuyListing.buy_price,
+                  self.oneSellListing.sell_price - self.twoBuyListing.buy_price, self.distance)
+        ]
+
+# sort name -> (label, key, largest first)
+LOOP_SORTS = {
+    'profit': ('Profit', Loop.profit, True),
+    'distance': ('Distance', Loop.min_distance, False),
+    'profitPerLy': ('Profit/ly', Loop.profit_per_ly, True),
+    'age': ('Freshest', attrgetter('collectedAt'), True),
+    'lapProfit': ('Profit/lap', attrgetter('lapProfit'), True),
+    'hourProfit': ('Profit/hour', attrgetter('hourProfit'), True)
+}
+
+class LoopRanking:
+    """Loops ordered by one of LOOP_SORTS, but only as far as the pages that were asked for.
+
+    Pages are cut from a top-k selection, which grows when a later page is needed, so
+    showing the first page of thousands of loops never sorts all of them.
+    """
+    def __init__(self, loops, sort='profit'):
+        self.loops = loops
+        self.sort = sort if sort in LOOP_SORTS else 'profit'
+        self.ranked = []  # the best len(self.ranked) loops in order
+
+    def __len__(self):
+        return len(self.loops)
+
+    def top(self, count):
+        if count > len(self.ranked) and len(self.ranked) < len(self.loops):
+            label, key, largest = LOOP_SORTS[self.sort]
+            select = heapq.nlargest if largest else heapq.nsmallest
+            self.ranked = select(max(count, len(self.ranked) * 2), self.loops, key=key)  # grow geometrically
+        return self.ranked[:count]
+
+    def page(self, pageIndx, pageSize):
+        start = pageIndx * pageSize
+        return self.top(start + pageSize)[start:]
+
+    def pageCount(self, pageSize):
+        return max(1, math.ceil(len(self.loops) / pageSize))
+
 @dataclass
 class LabelHolder:
     label: tk.Label
@@ -218,39 +330,55 @@ class LoopInfoLine:
     line2Labels: list[tk.Label] = None
     selectButton: tk.Button = None
     separator: ttk.Separator = None
-    # probably want to add a separator here
+    shownValues: dict = None  # last value written to each variable, so unchanged ones are skipped
 
     def __post_init__(self):
-        self.indxVar = tk.StringVar(value=self.indx)
         logger.debug(self.loop)
-        logger.debug(self.loop.oneBuyListing)
-        self.list1TimeAgo = tk.StringVar(value=self.loop.oneBuyListing.timeAgo())
-        self.list2TimeAgo = tk.StringVar(value=self.loop.twoBuyListing.timeAgo())
-        self.station1Icon = tk.StringVar(value=self.loop.oneStation.getTypeIcon())
-        self.station2Icon = tk.StringVar(value=self.loop.twoStation.getTypeIcon())        
-        self.distTo = tk.StringVar(value=self.loop.min_distance_str())
-        self.loopDist = tk.StringVar(value=self.loop.loop_length_str())
-        self.profit = tk.StringVar(value=self.loop.profit())
-        self.supply1 = tk.StringVar(value=self.loop.oneBuyListing.supply)
-        self.supply2 = tk.StringVar(value=self.loop.twoBuyListing.supply)
+        self.shownValues = dict()
+        self.indxVar = tk.StringVar()
+        self.list1TimeAgo = tk.StringVar()
+        self.list2TimeAgo = tk.StringVar()
+        self.station1Icon = tk.StringVar()
+        self.station2Icon = tk.StringVar()
+        self.distTo = tk.StringVar()
+        self.loopDist = tk.StringVar()
+        self.profit = tk.StringVar()
+        self.supply1 = tk.StringVar()
+        self.supply2 = tk.StringVar()
         self.line1Labels =  self.createLine1Labels()
         self.line2Labels =  self.createLine2Labels()
         self.selectButton = tk.Button(self.frame, text="Select", command=self.buttonFunc)
         self.separator = ttk.Separator(self.frame, orient=tk.HORIZONTAL)
+        self.updateLine(self.loop, self.indx, self.buttonFunc)
+
+    def setVar(self, var, value):
+        """Only touch the tk variable if what it shows has changed"""
+        name = str(var)
+        if self.shownValues.get(name) != value:
+            var.set(value)
+            self.shownValues[name] = value
 
     def updateLine(self, loop, indx, commandFunc):
         self.loop = loop
-        self.indxVar.set(indx)
-        self.list1TimeAgo.set(self.loop.oneBuyListing.timeAgo())
-        self.list2TimeAgo.set(self.loop.twoBuyListing.timeAgo())
-        self.station1Icon.set(self.loop.oneStation.getTypeIcon())
-        self.station2Icon.set(self.loop.twoStation.getTypeIcon())
-        self.distTo.set(self.loop.min_distance_str())
-        self.loopDist.set(self.loop.loop_length_str())
-        self.profit.set(self.loop.profit())
-        self.supply1.set(self.loop.oneBuyListing.supply)
-        self.supply2.set(self.loop.twoBuyListing.supply)
-        self.selectButton.configure(command=commandFunc)
+        self.setVar(self.indxVar, indx)
+        self.updateAges()
+        self.setVar(self.station1Icon, self.loop.oneStation.getTypeIcon())
+        self.setVar(self.station2Icon, self.loop.twoStation.getTypeIcon())
+        self.setVar(self.distTo, self.loop.min_distance_str())
+        self.setVar(self.loopDist, self.loop.loop_length_str())
+        self.setVar(self.profit, self.loop.profit())
+        self.setVar(self.supply1, self.loop.oneBuyListing.supply)
+        self.setVar(self.supply2, self.loop.twoBuyListing.supply)
+        if commandFunc != self.buttonFunc:
+            self.buttonFunc = commandFunc
+            self.selectButton.configure(command=commandFunc)
+
+    def updateAges(self, now=None):
+        """Refresh the listing ages, returns seconds until either of them could change"""
+        now = time.time() if now is None else now
+        self.setVar(self.list1TimeAgo, self.loop.oneBuyListing.timeAgo(now))
+        self.setVar(self.list2TimeAgo, self.loop.twoBuyListing.timeAgo(now))
+        return min(self.loop.oneBuyListing.nextTimeAgo(now), self.loop.twoBuyListing.nextTimeAgo(now))
     
     def createLine1Labels(self):
         labels = []
@@ -282,8 +410,25 @@ class LoopInfoLine:
 
 @dataclass
 class Route:
+    """One stop of a multi hop route, where `commodity` is bought to carry to the next stop"""
     system: System
     station: Station
     commodity: Commodity
     supply: int
-    cost: int
\ No newline at end of file
+    cost: int
+    profit: int = 0  # per unit, when sold at the next stop
+    distance: float = 0  # ly to the next stop
+
+def routeProfit(route):
+    return sum(stop.profit for stop in route)
+
+def routeText(route):
+    """A route as a heading and one line per stop, for the routes page"""
+    lines = [f'{routeProfit(route):,}Cr per unit over {len(route) - 1} hops']
+    for stop in route:
+        where = f'{stop.station.name} ({stop.system.name})'
+        if stop.commodity:
+            lines.append(f'  {where}: buy {stop.commodity.name} for +{stop.profit:,}Cr, {stop.distance:.0f} ly')
+        else:
+            lines.append(f'  {where}')
+    return '\n'.join(lines)
\ No newline at end of file
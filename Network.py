@@ -0,0 +1,82 @@
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Network')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@dataclass
+class RequestMetric:
+    method: str
+    url: str
+    status: int
+    seconds: float
+    attempt: int
+    error: str = None
+
+
+class HttpClient:
+    """Shared session for every network call the plugin makes.
+
+    Connections are kept alive and pooled, responses are gzip compressed where the server
+    supports it, every request has a timeout and failed requests are retried with bounded
+    exponential backoff. The latency of each attempt is kept in `metrics`.
+    """
+
+    def __init__(self, timeout=(5, 30), retries=3, backoff=0.5, maxBackoff=8, poolSize=4, userAgent='EDMC-Trade-Tracker') -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.metrics = deque(maxlen=200)
+        self.recorder = None  # SessionRecorder that every response is recorded to, if one is set
+        self.closed = threading.Event()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'User-Agent': userAgent})
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                self.record(method, url, None, start, attempt, repr(err))
+                if attempt == self.retries or self.closed.is_set():
+                    raise
+            else:
+                self.record(method, url, response.status_code, start, attempt)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    if self.recorder:
+                        self.recorder.http(method, url, response, kwargs.get('stream', False))
+                    return response
+                response.close()  # hand the connection back to the pool before retrying
+
+            delay = min(self.maxBackoff, self.backoff * 2 ** attempt)
+            logger.warning(f'{method} {url} failed, retrying in {delay}s')
+            if self.closed.wait(delay):
+                raise requests.ConnectionError(f'{method} {url} cancelled, client closed')
+
+    def record(self, method, url, status, start, attempt, error=None):
+        self.metrics.append(RequestMetric(method, url, status, time.perf_counter() - start, attempt, error))
+
+    def close(self):
+        self.closed.set()
+        self.session.close()
@@ -0,0 +1,86 @@
+import math
+import time
+import logging
+from array import array
+from dataclasses import dataclass
+
+from Models import rawValue
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Scoring')
+
+
+@dataclass
+class ScoringSettings:
+    cargoCapacity: int = 0  # tonnes, 0 when the ship isn't known so every unit of supply counts
+    jumpRange: float = 0  # ly, 0 when the ship isn't known so every hop is one jump
+    jumpSeconds: float = 45  # per jump, including the fuel scoop and charge
+    dockSeconds: float = 150  # per station, supercruise in, docking, trading and launching
+    halfLife: float = 24  # hours for the price age to halve the expected profit, 0 turns the decay off
+    laps: int = 5  # the trip out to the loop is spread over this many laps of the hourly rate
+
+
+class LoopScores:
+    """Expected profit of each loop per lap and per hour for a ship.
+
+    Every loop value the score needs is read once into columns, so scoring again for
+    another ship or setting is one pass over flat arrays and the loops are left alone
+    until the results are written back as `lapProfit` and `hourProfit`.
+    """
+
+    def __init__(self, loops) -> None:
+        self.loops = loops
+        self.margin1 = array('q')  # per unit profit carried from station one to two
+        self.margin2 = array('q')
+        self.units1 = array('q')  # units that can be bought at one and sold at two
+        self.units2 = array('q')
+        self.distance = array('d')  # ly between the stations
+        self.hop = array('d')  # ly from the commander to the nearest station
+        self.collectedAt = array('q')  # of the oldest listing
+        for loop in loops:
+            fields = loop.fields
+            self.margin1.append(rawValue(fields['twoSellListing'], 'sell_price') - rawValue(fields['oneBuyListing'], 'buy_price'))
+            self.margin2.append(rawValue(fields['oneSellListing'], 'sell_price') - rawValue(fields['twoBuyListing'], 'buy_price'))
+            self.units1.append(legUnits(fields['oneBuyListing'], fields['twoSellListing']))
+            self.units2.append(legUnits(fields['twoBuyListing'], fields['oneSellListing']))
+            self.distance.append(loop.distance)
+            self.hop.append(loop.min_distance())
+            self.collectedAt.append(loop.collectedAt)
+
+    def __len__(self):
+        return len(self.loops)
+
+    def evaluate(self, settings, now=None):
+        """Score every loop for `settings`, returns (profit per lap, profit per hour) columns"""
+        now = time.time() if now is None else now
+        cargo = settings.cargoCapacity or math.inf
+        if settings.halfLife:
+            rate = math.log(0.5) / (settings.halfLife * 3600)
+            decay = [math.exp(rate * max(0, now - collectedAt)) for collectedAt in self.collectedAt]
+        else:
+            decay = [1.0] * len(self.loops)
+        lapProfit = [(margin1 * min(units1, cargo) + margin2 * min(units2, cargo)) * weight
+                     for margin1, units1, margin2, units2, weight in zip(self.margin1, self.units1, self.margin2, self.units2, decay)]
+
+        jumpRange = settings.jumpRange or math.inf
+        jumpSeconds = settings.jumpSeconds
+        lapStops = 2 * settings.dockSeconds  # docking at both stations
+        laps = settings.laps
+        hourProfit = [3600 * laps * profit / (laps * (2 * max(1, math.ceil(distance / jumpRange)) * jumpSeconds + lapStops)
+                                              + math.ceil(hop / jumpRange) * jumpSeconds)
+                      for profit, distance, hop in zip(lapProfit, self.distance, self.hop)]
+        return lapProfit, hourProfit
+
+    def apply(self, settings, now=None):
+        """Score every loop for `settings` and store the results on the loops, for LOOP_SORTS"""
+        lapProfit, hourProfit = self.evaluate(settings, now)
+        for loop, lap, hour in zip(self.loops, lapProfit, hourProfit):
+            loop.lapProfit = round(lap)
+            loop.hourProfit = round(hour)
+
+
+def legUnits(buyListing, sellListing):
+    """Units one leg can carry before the supply or the demand runs out, stations list no demand for some goods they buy"""
+    demand = rawValue(sellListing, 'demand')
+    supply = rawValue(buyListing, 'supply')
+    return min(supply, demand) if demand > 0 else supply
@@ -0,0 +1,461 @@
+import math
+import time
+import heapq
+import logging
+from dataclasses import is_dataclass, asdict
+
+from Models import Loop, Route, System, Station, rawValue
+from Spatial import SystemIndex
+from Metrics import metrics
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Search')
+
+PAD_SIZES = {'S': 1, 'M': 2, 'L': 3}
+PLANETARY_TYPES = range(13, 18)
+FLEET_CARRIER_TYPES = (24, )
+
+
+def asRecord(record):
+    """Stations, systems and listings can be passed as models or as the raw json dicts"""
+    return asdict(record) if is_dataclass(record) else record
+
+
+class LoopSearch:
+    """Finds two station trade loops from market data held locally instead of asking eddb"""
+
+    def __init__(self) -> None:
+        self.systems = dict()  # system id -> system dict
+        self.stations = dict()  # station id -> station dict
+        self.listings = dict()  # station id -> {commodity id -> listing dict}
+        self.commodities = dict()  # commodity id -> Commodity
+        self.systemStations = dict()  # system id -> list of station ids
+        self.systemNames = dict()  # lower case name -> system id
+        self.marketStations = dict()  # ed_market_id -> station id
+        self.coverage = set()  # systems whose surroundings were bulk loaded, so a search there is complete
+        self.systemIndex = SystemIndex()
+        self.lastSearch = None  # settings of the last search, used when re-ranking
+        self.matrix = None  # TradeMatrix for the last search's settings
+        self.nextLoopId = 1
+        self.nextListingId = -1  # listings we make up ourselves get negative ids
+
+    def load(self, systems, stations, listings, commodities=None, coverage=None):
+        """Replace the data being searched.
+
+        `coverage` is the systems whose whole search area is in the data, all of them by default.
+        """
+        self.systems = {system['id']: system for system in map(asRecord, systems)}
+        self.stations = {station['id']: station for station in map(asRecord, stations)}
+        self.systemIndex.build(self.systems.values())
+        self.systemNames = {system['name'].lower(): system['id'] for system in self.systems.values()}
+        self.systemStations = dict()
+        self.marketStations = dict()
+        for station in self.stations.values():
+            self.systemStations.setdefault(station['system_id'], []).append(station['id'])
+            if station.get('ed_market_id'):
+                self.marketStations[station['ed_market_id']] = station['id']
+        self.listings = dict()
+        for listing in map(asRecord, listings):
+            self.listings.setdefault(listing['station_id'], dict())[listing['commodity_id']] = listing
+        self.coverage = set(self.systems) if coverage is None else set(coverage)
+        self.matrix = None
+        if commodities is not None:
+            self.commodities = commodities
+        logger.info(f'Loaded {len(self.systems)} systems, {len(self.stations)} stations for loop search')
+
+    def hasSystem(self, systemId):
+        return systemId in self.coverage
+
+    def systemId(self, name):
+        return self.systemNames.get(name.lower())
+
+    def updateSystem(self, system):
+        """Add or update a system, one we already know by name keeps its id. Returns the id used"""
+        system = asRecord(system)
+        knownId = self.systemNames.get(system['name'].lower())
+        if knownId is not None:
+            system = {**system, 'id': knownId}
+        self.systems[system['id']] = system
+        self.systemNames[system['name'].lower()] = system['id']
+        self.systemIndex.add(system['id'], (system['x'], system['y'], system['z']))
+        return system['id']
+
+    def updateStation(self, station, listings=None):
+        """Add or update a station and replace its listings in place. Returns the station id used.
+
+        A station we already know by market id or by name in its system keeps its id.
+        """
+        station = asRecord(station)
+        knownId = self.marketStations.get(station.get('ed_market_id'))
+        if knownId is None:
+            knownId = next((stationId for stationId in self.systemStations.get(station['system_id'], ())
+                            if self.stations[stationId]['name'].lower() == station['name'].lower()), None)
+        if knownId is not None:
+            station = {**station, 'id': knownId}
+        stationId = station['id']
+        if stationId not in self.stations:
+            self.systemStations.setdefault(station['system_id'], []).append(stationId)
+        self.stations[stationId] = station
+        if station.get('ed_market_id'):
+            self.marketStations[station['ed_market_id']] = stationId
+        if listings is None:
+            self.updateMatrix(stationId)
+            return stationId
+
+        current = self.listings.get(stationId, dict())
+        updated = dict()
+        for listing in map(asRecord, listings):
+            listing = {**listing, 'station_id': stationId}
+            previous = current.get(listing['commodity_id'])
+            if previous:
+                listing['id'] = previous['id']
+            elif listing['id'] is None:
+                listing['id'] = self.nextListingId
+                self.nextListingId = self.nextListingId - 1
+            updated[listing['commodity_id']] = listing
+        self.listings[stationId] = updated
+        self.updateMatrix(stationId)
+        return stationId
+
+    def updateMatrix(self, stationId):
+        if self.matrix is not None:
+            with metrics.span('search.matrixUpdate'):
+                self.matrix.updateStation(stationId)
+
+    def search(self, systemId, hopDistance=50, minSupply=0, minDemand=0, priceAge=30, minProfit=9500,
+               includePlanetary=True, landingPad='L', maxDistance=100, limit=50):
+        """Returns up to `limit` loops near `systemId` ordered by profit.
+
+        `priceAge` is in days and `landingPad` is the smallest pad size a station must have.
+        """
+        self.lastSearch = dict(systemId=systemId, hopDistance=hopDistance, minSupply=minSupply, minDemand=minDemand,
+                               priceAge=priceAge, minProfit=minProfit, includePlanetary=includePlanetary,
+                               landingPad=landingPad, maxDistance=maxDistance, limit=limit)
+        return self.topLoops(self.lastSearch)
+
+    def topLoops(self, search):
+        """Best loops for the search settings from the trade matrix, building it if the settings changed"""
+        key = TradeMatrix.key(search)
+        if self.matrix is None or self.matrix.settings != key:
+            with metrics.span('search.pairs'):
+                self.matrix = TradeMatrix(self, search)
+        with metrics.span('search.rank'):
+            return self.buildLoops(self.matrix.top(search['limit'], search['minProfit']), self.systems[search['systemId']])
+
+    def refreshStation(self, loops, stationId, fromSearch=False):
+        """Re-rank `loops` after a station's market changed.
+
+        Only loops that visit the station are repriced. If the loops came from the last local
+        search they are taken from the trade matrix again, where only the station's pairs changed.
+        """
+        if fromSearch and self.lastSearch is not None:
+            return self.topLoops(self.lastSearch)  # the station's pairs were already updated in the matrix
+
+        station = self.stations[stationId]
+        search = dict(minSupply=0, minDemand=0, priceAge=30, minProfit=0)
+        refreshed = []
+        for loop in loops:
+            side = self.loopSide(loop, station)
+            if side:
+                loop = self.repricedLoop(loop, side, stationId, search)
+            if loop:
+                refreshed.append(loop)
+        return heapq.nlargest(len(loops), refreshed, key=lambda loop: loop.profit())
+
+    def loopSide(self, loop, station):
+        """'one' or 'two' for the end of the loop at `station`, None if the loop doesn't visit it"""
+        for side in ('one', 'two'):
+            loopStation = loop.fields[f'{side}Station']
+            if rawValue(loopStation, 'id') == station['id']:
+                return side
+            marketId = loopStation.get('ed_market_id') if isinstance(loopStation, dict) else loopStation.ed_market_id
+            if marketId and marketId == station.get('ed_market_id'):
+                return side
+        return None
+
+    def repricedLoop(self, loop, side, stationId, search):
+        """A copy of `loop` using the station's current prices, None if the loop no longer works"""
+        other = 'two' if side == 'one' else 'one'
+        raw = loop.raw()
+        listings = self.listings.get(stationId, dict())
+        buyListing = listings.get(rawValue(raw[f'{side}Commodity'], 'id'))
+        sellListing = listings.get(rawValue(raw[f'{other}Commodity'], 'id'))
+        if not buyListing or not sellListing:
+            return None
+        if buyListing['buy_price'] <= 0 or buyListing['supply'] < max(search['minSupply'], 1):
+            return None
+        if sellListing['sell_price'] <= 0 or sellListing['demand'] < search['minDemand']:
+            return None
+        loopStationId = raw[f'{side}Station']['id']
+        raw[f'{side}BuyListing'] = {**buyListing, 'station_id': loopStationId}
+        raw[f'{side}SellListing'] = {**sellListing, 'station_id': loopStationId}
+        repriced = Loop(**raw)
+        return repriced if repriced.profit() >= search['minProfit'] else None
+
+    def candidatesNear(self, point, radius, search):
+        """Stations within `radius` of `point` that pass the search filters, by system id"""
+        oldest = time.time() - search['priceAge'] * 86400
+        minPad = PAD_SIZES.get(search.get('landingPad', 'L'), 0)
+        includePlanetary = search.get('includePlanetary', True)
+        candidates = dict()  # system id -> [(station, system, exports, imports)]
+        for systemId, _ in self.systemIndex.within(point, radius):
+            for stationId in self.systemStations.get(systemId, ()):
+                candidate = self.candidate(stationId, search, oldest, includePlanetary, minPad)
+                if candidate:
+                    candidates.setdefault(systemId, []).append(candidate)
+        return candidates
+
+    def candidate(self, stationId, search, oldest, includePlanetary, minPad):
+        """(station, system, exports, imports) if the station passes the search filters, otherwise None"""
+        station = self.stations[stationId]
+        if not self.stationAllowed(station, includePlanetary, minPad):
+            return None
+        exports, imports = self.stationTrades(stationId, search['minSupply'], search['minDemand'], oldest)
+        if not exports and not imports:
+            return None
+        return (station, self.systems[station['system_id']], exports, imports)
+
+    def buildLoops(self, trades, userSystem):
+        """Only the loops that are returned get turned into models"""
+        loops = []
+        for trade in trades:
+            loop = self.buildLoop(*trade[1:], userSystem)
+            if loop:
+                loops.append(loop)
+        return loops
+
+    def searchRoutes(self, systemId, hops=4, roundTrip=False, hopDistance=50, minSupply=0, minDemand=0, priceAge=30,
+                     minProfit=0, minHopProfit=1, includePlanetary=True, landingPad='L', maxDistance=100,
+                     beamWidth=200, limit=10):
+        """Best routes of `hops` trades between stations near `systemId`, as lists of Route stops.
+
+        A beam search that keeps the `beamWidth` most profitable partial routes after each hop.
+        Hops are limited to `hopDistance` and must make at least `minHopProfit` per unit. With
+        `roundTrip` the last hop returns to the first station. Routes are ordered by profit.
+        """
+        search = dict(minSupply=minSupply, minDemand=minDemand, priceAge=priceAge,
+                      includePlanetary=includePlanetary, landingPad=landingPad)
+        with metrics.span('search.routeCandidates'):
+            candidates = [candidate for systemCandidates in self.candidatesNear(self.systemIndex.position(systemId), maxDistance, search).values()
+                          for candidate in systemCandidates]
+            bySystem = dict()
+            for indx, candidate in enumerate(candidates):
+                bySystem.setdefault(candidate[1]['id'], []).append(indx)
+            neighbours = []  # candidate index -> [(candidate index, distance)]
+            for candidate in candidates:
+                near = self.systemIndex.within(self.systemIndex.position(candidate[1]['id']), hopDistance)
+                neighbours.append([(other, distance) for nearId, distance in near for other in bySystem.get(nearId, ())])
+
+        trades = dict()  # (from, to) -> (trade, profit), filled in as the search needs them
+        def trade(fromIndx, toIndx):
+            key = (fromIndx, toIndx)
+            if key not in trades:
+                trades[key] = self.bestTrade(candidates[fromIndx][2], candidates[toIndx][3])
+            return trades[key]
+
+        with metrics.span('search.routes'):
+            # a beam entry is (profit, [(candidate index, trade, distance)...]) with the last stop's trade None
+            beam = [(0, [(indx, None, 0)]) for indx in range(len(candidates))]
+            for hop in range(hops):
+                lastHop = hop == hops - 1
+                extended = []
+                for profit, path in beam:
+                    here = path[-1][0]
+                    visited = {stop[0] for stop in path}
+                    for there, distance in neighbours[here]:
+                        if there == here:
+                            continue
+                        if lastHop and roundTrip:
+                            if there != path[0][0]:
+                                continue
+                        elif there in visited:
+                            continue
+                        best, hopProfit = trade(here, there)
+                        if not best or hopProfit < minHopProfit:
+                            continue
+                        extended.append((profit + hopProfit, path[:-1] + [(here, best, distance), (there, None, 0)]))
+                beam = heapq.nlargest(beamWidth, extended, key=lambda entry: entry[0])
+
+        routes = []
+        for profit, path in beam:
+            if profit < minProfit:
+                break
+            routes.append(self.buildRoute(candidates, path))
+            if len(routes) == limit:
+                break
+        return routes
+
+    def buildRoute(self, candidates, path):
+        route = []
+        for indx, best, distance in path:
+            station, system = candidates[indx][:2]
+            if best:
+                buyListing, sellListing = best
+                route.append(Route(
+                    system=System(**system),
+                    station=Station(**station),
+                    commodity=self.commodities.get(buyListing['commodity_id']),
+                    supply=buyListing['supply'],
+                    cost=buyListing['buy_price'],
+                    profit=sellListing['sell_price'] - buyListing['buy_price'],
+                    distance=distance
+                ))
+            else:
+                route.append(Route(system=System(**system), station=Station(**station), commodity=None, supply=0, cost=0))
+        return route
+
+    def stationAllowed(self, station, includePlanetary, minPad):
+        if station['type_id'] in FLEET_CARRIER_TYPES:
+            return False
+        if not includePlanetary and station['type_id'] in PLANETARY_TYPES:
+            return False
+        return PAD_SIZES.get(station['max_landing_pad_size'], 0) >= minPad
+
+    def stationTrades(self, stationId, minSupply, minDemand, oldest):
+        """Splits a station's listings into what can be bought and what can be sold there"""
+        exports = dict()  # commodity id -> listing to buy from
+        imports = dict()  # commodity id -> listing to sell to
+        for listing in self.listings.get(stationId, dict()).values():
+            if listing['collected_at'] < oldest:
+                continue
+            if listing['buy_price'] > 0 and listing['supply'] >= max(minSupply, 1):
+                exports[listing['commodity_id']] = listing
+            if listing['sell_price'] > 0 and listing['demand'] >= minDemand:
+                imports[listing['commodity_id']] = listing
+        return exports, imports
+
+    def bestTrade(self, exports, imports):
+        """The most profitable commodity to carry from the exporting station to the importing one"""
+        best = None
+        bestProfit = 0
+        if len(exports) > len(imports):
+            commodityIds = [commodityId for commodityId in imports if commodityId in exports]
+        else:
+            commodityIds = [commodityId for commodityId in exports if commodityId in imports]
+        for commodityId in commodityIds:
+            profit = imports[commodityId]['sell_price'] - exports[commodityId]['buy_price']
+            if profit > bestProfit:
+                best = (exports[commodityId], imports[commodityId])
+                bestProfit = profit
+        return best, bestProfit
+
+    def buildLoop(self, one, two, outbound, inbound, distance, userSystem):
+        oneStation, oneSystem = one[:2]
+        twoStation, twoSystem = two[:2]
+        oneCommodity = self.commodities.get(outbound[0]['commodity_id'])
+        twoCommodity = self.commodities.get(inbound[0]['commodity_id'])
+        if not oneCommodity or not twoCommodity:
+            return None
+
+        loopId = self.nextLoopId
+        self.nextLoopId = self.nextLoopId + 1
+        return Loop(
+            oneBuyListing=outbound[0],
+            twoBuyListing=inbound[0],
+            oneSellListing=inbound[1],
+            twoSellListing=outbound[1],
+            oneStation=oneStation,
+            twoStation=twoStation,
+            oneSystem=oneSystem,
+            twoSystem=twoSystem,
+            oneCommodity=oneCommodity,
+            twoCommodity=twoCommodity,
+            distance=distance,
+            userSystem=userSystem,
+            tradeLoopId=loopId
+        )
+
+
+class TradeMatrix:
+    """Best trade in each direction for every pair of stations within hop range of each other.
+
+    The matrix is built for one set of search settings over the stations around the search
+    system. When a station's market changes only the pairs that include it are worked out
+    again, so ranking loops is a top-k over the stored pairs instead of a full search.
+    """
+    SETTINGS = ('systemId', 'maxDistance', 'hopDistance', 'minSupply', 'minDemand', 'priceAge', 'includePlanetary', 'landingPad')
+
+    @classmethod
+    def key(cls, search):
+        return tuple(search.get(name) for name in cls.SETTINGS)
+
+    def __init__(self, loopSearch, search) -> None:
+        self.loopSearch = loopSearch
+        self.search = search
+        self.settings = self.key(search)
+        self.origin = loopSearch.systemIndex.position(search['systemId'])
+        self.candidates = dict()  # station id -> (station, system, exports, imports)
+        self.systemCandidates = dict()  # system id -> station ids in the matrix
+        self.pairs = dict()  # (lower station id, higher station id) -> (profit, one, two, outbound, inbound, distance)
+        self.stationPairs = dict()  # station id -> pair keys it is part of
+
+        for systemId, systemCandidates in loopSearch.candidatesNear(self.origin, search['maxDistance'], search).items():
+            for candidate in systemCandidates:
+                self.candidates[candidate[0]['id']] = candidate
+                self.systemCandidates.setdefault(systemId, []).append(candidate[0]['id'])
+        for systemId in self.systemCandidates:
+            for nearId, distance in self.near(systemId):
+                if nearId < systemId:
+                    continue  # each pair of systems is only checked once
+                for oneId in self.systemCandidates[systemId]:
+                    for twoId in self.systemCandidates[nearId]:
+                        if nearId != systemId or oneId < twoId:
+                            self.addPair(oneId, twoId, distance)
+        logger.debug(f'Trade matrix has {len(self.pairs)} pairs between {len(self.candidates)} stations')
+
+    def near(self, systemId):
+        """Systems in the matrix within hop range of `systemId`"""
+        systemIndex = self.loopSearch.systemIndex
+        return [(nearId, distance) for nearId, distance in systemIndex.within(systemIndex.position(systemId), self.search['hopDistance'])
+                if nearId in self.systemCandidates]
+
+    def addPair(self, oneId, twoId, distance):
+        if oneId > twoId:
+            oneId, twoId = twoId, oneId
+        one = self.candidates[oneId]
+        two = self.candidates[twoId]
+        outbound, outProfit = self.loopSearch.bestTrade(one[2], two[3])
+        if not outbound:
+            return
+        inbound, inProfit = self.loopSearch.bestTrade(two[2], one[3])
+        if not inbound:
+            return
+        key = (oneId, twoId)
+        self.pairs[key] = (outProfit + inProfit, one, two, outbound, inbound, distance)
+        self.stationPairs.setdefault(oneId, set()).add(key)
+        self.stationPairs.setdefault(twoId, set()).add(key)
+
+    def removeStation(self, stationId):
+        for key in self.stationPairs.pop(stationId, ()):
+            self.pairs.pop(key, None)
+            other = key[1] if key[0] == stationId else key[0]
+            self.stationPairs.get(other, set()).discard(key)
+        candidate = self.candidates.pop(stationId, None)
+        if candidate:
+            systemStations = self.systemCandidates[candidate[1]['id']]
+            systemStations.remove(stationId)
+            if not systemStations:
+                del self.systemCandidates[candidate[1]['id']]
+
+    def updateStation(self, stationId):
+        """Work out the pairs of a station whose market or details changed"""
+        self.removeStation(stationId)
+        station = self.loopSearch.stations.get(stationId)
+        system = self.loopSearch.systems.get(station['system_id']) if station else None
+        if system is None or math.dist(self.origin, (system['x'], system['y'], system['z'])) > self.search['maxDistance']:
+            return
+        search = self.search
+        candidate = self.loopSearch.candidate(stationId, search, time.time() - search['priceAge'] * 86400,
+                                              search.get('includePlanetary', True), PAD_SIZES.get(search.get('landingPad', 'L'), 0))
+        if not candidate:
+            return
+        self.candidates[stationId] = candidate
+        self.systemCandidates.setdefault(system['id'], []).append(stationId)
+        for nearId, distance in self.near(system['id']):
+            for otherId in self.systemCandidates[nearId]:
+                if otherId != stationId:
+                    self.addPair(stationId, otherId, distance)
+
+    def top(self, limit, minProfit):
+        """The `limit` most profitable pairs making at least `minProfit`"""
+        return heapq.nlargest(limit, (pair for pair in self.pairs.values() if pair[0] >= minProfit), key=lambda pair: pair[0])
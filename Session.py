@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import base64
+import logging
+import threading
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Session')
+
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+MAX_BODY = 8 * 1024 * 1024  # bytes, bigger bodies like a listings.csv sync are recorded empty
+JOURNAL_FILES = {'Market': 'Market.json', 'NavRoute': 'NavRoute.json'}  # events whose data is in a file next to the journal
+
+
+class SessionRecorder:
+    """Records what a play session fed the plugin, so it can be replayed offline.
+
+    Each line of the session file is a json object with `at`, seconds since recording
+    started, and a `kind`: 'journal' events with the contents of any file they refer to,
+    'http' responses, or 'click' for the buttons pressed. A streamed response's 'http'
+    record has an `id` and no body, its body follows in an 'httpBody' record with that id
+    once the plugin has read it. benchmarks/replay.py plays a session back.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.lastResponseId = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        logger.info(f'Recording session to {path}')
+
+    def write(self, kind, **record):
+        line = json.dumps({'at': round(time.monotonic() - self.started, 3), 'kind': kind, **record}, separators=(',', ':'))
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line + '\n')
+                self.file.flush()
+
+    def journal(self, entry, journalDir):
+        files = dict()
+        name = JOURNAL_FILES.get(entry['event'])
+        if name:
+            try:
+                with open(os.path.join(journalDir, name), 'r', encoding='utf-8') as journalFile:
+                    files[name] = journalFile.read()
+            except OSError as err:
+                logger.warning(f'Unable to record {name}: {err}')
+        self.write('journal', entry=entry, files=files)
+
+    def http(self, method, url, response, stream=False):
+        """Record a response as it is returned.
+
+        A streamed response's status and headers are recorded straight away, even if the
+        body is never read (a 304, or an error status that is raised), and its body is
+        recorded as the caller reads it, from a copy of each chunk, so recording never reads
+        a body ahead of the caller.
+        """
+        if not stream:
+            self.writeHttp(method, url, response, response.content)
+            return
+        with self.lock:
+            self.lastResponseId = responseId = self.lastResponseId + 1
+        self.writeHttp(method, url, response, b'', id=responseId)
+        iterContent = response.iter_content
+
+        def recordedContent(chunk_size=1, decode_unicode=False):
+            body = bytearray()
+            try:
+                for chunk in iterContent(chunk_size, decode_unicode):
+                    if body is not None:
+                        body.extend(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                        if len(body) > MAX_BODY:
+                            body = None
+                    yield chunk
+            finally:
+                self.write('httpBody', id=responseId, body=base64.b64encode(body or b'').decode('ascii'), skipped=body is None)
+
+        response.iter_content = recordedContent  # iter_lines and content read through this too
+
+    def writeHttp(self, method, url, response, body, **record):
+        if body is not None and len(body) > MAX_BODY:
+            body = None
+        self.write('http', method=method, url=url, status=response.status_code,
+                   headers={name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+                   body=base64.b64encode(body or b'').decode('ascii'), skipped=body is None, **record)
+
+    def click(self, state, **args):
+        self.write('click', state=state, **args)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def readSession(path):
+    with open(path, 'r', encoding='utf-8') as sessionFile:
+        return [json.loads(line) for line in sessionFile if line.strip()]
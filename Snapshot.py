@@ -0,0 +1,227 @@
+import os
+import json
+import math
+import mmap
+import time
+import struct
+import bisect
+import logging
+from array import array
+from dataclasses import fields, is_dataclass, asdict
+
+from Models import System, Station
+from Search import PAD_SIZES, PLANETARY_TYPES, FLEET_CARRIER_TYPES
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Snapshot')
+
+MAGIC = b'ETTSNAP1'
+NULL_INT = -2 ** 63  # stands in for None in integer columns, None bools are stored as -1
+TYPECODES = {int: 'q', float: 'd', bool: 'b'}  # anything else is stored as a string column
+
+
+def columnTypes(modelClass):
+    return {field.name: TYPECODES.get(field.type, 's') for field in fields(modelClass)}
+
+
+def encodeColumn(values, typecode):
+    """Bytes of one column, strings become an offset array followed by the utf-8 text"""
+    if typecode == 's':
+        offsets = array('q', [0])
+        text = bytearray()
+        for value in values:
+            text.extend(('' if value is None else str(value)).encode('utf-8'))
+            offsets.append(len(text))
+        return offsets.tobytes() + bytes(text)
+    if typecode == 'q':
+        return array('q', (NULL_INT if value is None else value for value in values)).tobytes()
+    if typecode == 'b':
+        return array('b', (-1 if value is None else bool(value) for value in values)).tobytes()
+    return array('d', (math.nan if value is None else value for value in values)).tobytes()
+
+
+def writeSnapshot(path, systems, stations):
+    """Write systems and stations (models or dicts) to a columnar snapshot file.
+
+    Systems are stored sorted by x so a slab of space is one bisect away, and stations
+    sorted by system so a system's stations are one contiguous run.
+    """
+    systems = sorted((asdict(system) if is_dataclass(system) else system for system in systems), key=lambda system: system['x'])
+    stations = sorted((asdict(station) if is_dataclass(station) else station for station in stations),
+                      key=lambda station: (station['system_id'], station['id']))
+    tables = {
+        'systems': (systems, {**columnTypes(System), 'row_by_id': 'q', 'id_sorted': 'q'}),
+        'stations': (stations, {**columnTypes(Station), 'pad_size': 'b'})
+    }
+    systemOrder = sorted(range(len(systems)), key=lambda row: systems[row]['id'])
+    derived = {
+        ('systems', 'id_sorted'): [systems[row]['id'] for row in systemOrder],
+        ('systems', 'row_by_id'): systemOrder,
+        ('stations', 'pad_size'): [PAD_SIZES.get(station['max_landing_pad_size'], 0) for station in stations]
+    }
+
+    header = {'createdAt': round(time.time()), 'tables': dict()}
+    blobs = []
+    offset = 0
+    for tableName, (rows, columns) in tables.items():
+        tableHeader = {'count': len(rows), 'columns': dict()}
+        for column, typecode in columns.items():
+            values = derived.get((tableName, column)) or [row.get(column) for row in rows]
+            blob = encodeColumn(values, typecode)
+            blob = blob + bytes(-len(blob) % 8)  # keep every column 8 byte aligned
+            tableHeader['columns'][column] = {'type': typecode, 'offset': offset, 'length': len(blob)}
+            blobs.append(blob)
+            offset = offset + len(blob)
+        header['tables'][tableName] = tableHeader
+
+    headerBytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    headerBytes = headerBytes + b' ' * (-(len(MAGIC) + 4 + len(headerBytes)) % 8)
+    tmpPath = f'{path}.tmp'
+    with open(tmpPath, 'wb') as snapshotFile:
+        snapshotFile.write(MAGIC)
+        snapshotFile.write(struct.pack('<I', len(headerBytes)))
+        snapshotFile.write(headerBytes)
+        for blob in blobs:
+            snapshotFile.write(blob)
+    os.replace(tmpPath, path)
+    logger.info(f'Wrote snapshot of {len(systems)} systems and {len(stations)} stations')
+
+
+class SnapshotTable:
+    """One table of a snapshot, read straight from the memory map.
+
+    Numeric columns are memoryviews over the map, so scanning one touches no other column
+    and builds no records. Rows only become dicts or models when they are asked for.
+    """
+    def __init__(self, buffer, start, header, modelClass) -> None:
+        self.count = header['count']
+        self.modelClass = modelClass
+        self.columns = dict()
+        self.strings = dict()  # column -> (offsets, text)
+        for name, column in header['columns'].items():
+            view = buffer[start + column['offset']:start + column['offset'] + column['length']]
+            if column['type'] == 's':
+                offsets = view[:(self.count + 1) * 8].cast('q')
+                self.strings[name] = (offsets, view[(self.count + 1) * 8:])
+            else:
+                self.columns[name] = view.cast(column['type'])[:self.count]
+        self.fieldNames = [field.name for field in fields(modelClass)]
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        return self.columns[name]
+
+    def value(self, name, row):
+        if name in self.strings:
+            offsets, text = self.strings[name]
+            return bytes(text[offsets[row]:offsets[row + 1]]).decode('utf-8')
+        column = self.columns[name]
+        value = column[row]
+        if column.format == 'd':
+            return None if math.isnan(value) else value
+        if column.format == 'b':
+            return None if value == -1 else bool(value)
+        return None if value == NULL_INT else value
+
+    def record(self, row):
+        return {name: self.value(name, row) for name in self.fieldNames}
+
+    def model(self, row):
+        return self.modelClass(**self.record(row))
+
+    def release(self):
+        for view in self.columns.values():
+            view.release()
+        for offsets, text in self.strings.values():
+            offsets.release()
+            text.release()
+
+
+class Snapshot:
+    """Memory mapped columnar snapshot of every system and station.
+
+    Opening one costs a header read, the operating system pages the columns in as they
+    are scanned. Use writeSnapshot to create one, and close it before replacing the file.
+    """
+    def __init__(self, path) -> None:
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.map[:len(MAGIC)] != MAGIC:
+                raise ValueError('Not a snapshot file')
+            headerLength = struct.unpack_from('<I', self.map, len(MAGIC))[0]
+            start = len(MAGIC) + 4
+            header = json.loads(self.map[start:start + headerLength])
+        except Exception:
+            self.file.close()
+            raise
+        self.createdAt = header['createdAt']
+        self.buffer = memoryview(self.map)
+        dataStart = start + headerLength
+        self.systems = SnapshotTable(self.buffer, dataStart, header['tables']['systems'], System)
+        self.stations = SnapshotTable(self.buffer, dataStart, header['tables']['stations'], Station)
+
+    @classmethod
+    def open(cls, path):
+        """The snapshot at `path`, None if there isn't a readable one"""
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError, KeyError) as err:
+            logger.warning(f'Unable to open snapshot: {err}')
+            return None
+
+    def close(self):
+        self.systems.release()
+        self.stations.release()
+        self.buffer.release()
+        self.map.close()
+        self.file.close()
+
+    def systemRow(self, systemId):
+        ids = self.systems.column('id_sorted')
+        indx = bisect.bisect_left(ids, systemId)
+        if indx < len(ids) and ids[indx] == systemId:
+            return self.systems.column('row_by_id')[indx]
+        return None
+
+    def system(self, systemId):
+        row = self.systemRow(systemId)
+        return None if row is None else self.systems.model(row)
+
+    def systemRowsNear(self, point, radius):
+        """Rows of the systems within `radius` of `point`"""
+        px, py, pz = point
+        xs = self.systems.column('x')
+        ys = self.systems.column('y')
+        zs = self.systems.column('z')
+        start = bisect.bisect_left(xs, px - radius)
+        end = bisect.bisect_right(xs, px + radius)
+        radiusSq = radius * radius
+        return [row for row in range(start, end)
+                if (xs[row] - px) ** 2 + (ys[row] - py) ** 2 + (zs[row] - pz) ** 2 <= radiusSq]
+
+    def stationRows(self, systemId):
+        """Rows of a system's stations"""
+        systemIds = self.stations.column('system_id')
+        return range(bisect.bisect_left(systemIds, systemId), bisect.bisect_right(systemIds, systemId))
+
+    def area(self, point, radius, minPad=0, includePlanetary=True):
+        """Systems within `radius` of `point` and the stations in them a loop search could use, as dicts.
+
+        Stations are filtered on the pad size and type columns before any record is built.
+        """
+        padSizes = self.stations.column('pad_size')
+        typeIds = self.stations.column('type_id')
+        systemIds = self.systems.column('id')
+        systems, stations = [], []
+        for systemRow in self.systemRowsNear(point, radius):
+            systems.append(self.systems.record(systemRow))
+            stations.extend(self.stations.record(row) for row in self.stationRows(systemIds[systemRow])
+                            if padSizes[row] >= minPad and typeIds[row] not in FLEET_CARRIER_TYPES
+                            and (includePlanetary or typeIds[row] not in PLANETARY_TYPES))
+        return systems, stations
@@ -0,0 +1,133 @@
+import math
+import heapq
+import logging
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Spatial')
+
+
+class SystemIndex:
+    """Grid of system coordinates for finding systems near a point without checking every system.
+
+    Systems are bucketed into cubes `cellSize` ly wide, so a radius query only looks at the
+    buckets that overlap the search sphere. Points are (x, y, z) tuples.
+    """
+
+    def __init__(self, cellSize=25) -> None:
+        self.cellSize = cellSize
+        self.cells = dict()  # (cx, cy, cz) -> list of system ids
+        self.positions = dict()  # system id -> (x, y, z)
+        self.minCell = None
+        self.maxCell = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, systemId):
+        return systemId in self.positions
+
+    def cellOf(self, point):
+        return tuple(math.floor(coord / self.cellSize) for coord in point)
+
+    def build(self, systems):
+        """Index systems from models or json dicts"""
+        self.cells = dict()
+        self.positions = dict()
+        self.minCell = None
+        self.maxCell = None
+        for system in systems:
+            if isinstance(system, dict):
+                self.add(system['id'], (system['x'], system['y'], system['z']))
+            else:
+                self.add(system.id, (system.x, system.y, system.z))
+        logger.debug(f'Indexed {len(self.positions)} systems in {len(self.cells)} cells')
+
+    def add(self, systemId, point):
+        if systemId in self.positions:
+            self.remove(systemId)
+        cell = self.cellOf(point)
+        self.positions[systemId] = tuple(point)
+        self.cells.setdefault(cell, []).append(systemId)
+        if self.minCell is None:
+            self.minCell = cell
+            self.maxCell = cell
+        else:
+            self.minCell = tuple(map(min, self.minCell, cell))
+            self.maxCell = tuple(map(max, self.maxCell, cell))
+
+    def remove(self, systemId):
+        point = self.positions.pop(systemId, None)
+        if point is None:
+            return
+        cell = self.cellOf(point)
+        self.cells[cell].remove(systemId)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def position(self, systemId):
+        return self.positions.get(systemId)
+
+    def within(self, point, radius):
+        """Returns [(systemId, distance)] for every system within `radius` ly of `point`"""
+        if not self.positions:
+            return []
+        low = self.cellOf([coord - radius for coord in point])
+        high = self.cellOf([coord + radius for coord in point])
+        low = tuple(map(max, low, self.minCell))
+        high = tuple(map(min, high, self.maxCell))
+
+        found = []
+        positions = self.positions
+        cells = self.cells
+        px, py, pz = point
+        radiusSq = radius * radius
+        for cx in range(low[0], high[0] + 1):
+            for cy in range(low[1], high[1] + 1):
+                for cz in range(low[2], high[2] + 1):
+                    for systemId in cells.get((cx, cy, cz), ()):
+                        x, y, z = positions[systemId]
+                        distSq = (x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2
+                        if distSq <= radiusSq:
+                            found.append((systemId, math.sqrt(distSq)))
+        return found
+
+    def nearest(self, point, k=1):
+        """Returns the `k` closest systems to `point` as [(systemId, distance)], closest first"""
+        if not self.positions:
+            return []
+        k = min(k, len(self.positions))
+        centre = self.cellOf(point)
+        maxRing = max(max(abs(c - low), abs(high - c)) for c, low, high in zip(centre, self.minCell, self.maxCell))
+        best = []  # max heap of the k closest so far, stored as (-distance, systemId)
+        for ring in range(maxRing + 1):
+            for cell in self.ringCells(centre, ring):
+                for systemId in self.cells.get(cell, ()):
+                    distance = math.dist(point, self.positions[systemId])
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, systemId))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, systemId))
+            # anything in a further ring is at least ring * cellSize away
+            if len(best) == k and -best[0][0] <= ring * self.cellSize:
+                break
+        return sorted(((systemId, -negDist) for negDist, systemId in best), key=lambda found: found[1])
+
+    def ringCells(self, centre, ring):
+        """Cells on the surface of the cube `ring` cells out from `centre`"""
+        cx, cy, cz = centre
+        if ring == 0:
+            yield centre
+            return
+        for dx in range(-ring, ring + 1):
+            for dy in range(-ring, ring + 1):
+                if abs(dx) == ring or abs(dy) == ring:
+                    for dz in range(-ring, ring + 1):
+                        yield (cx + dx, cy + dy, cz + dz)
+                else:
+                    yield (cx + dx, cy + dy, cz - ring)
+                    yield (cx + dx, cy + dy, cz + ring)
+
+    def distances(self, point, systemIds):
+        """Distances from `point` to each of `systemIds`, None for systems that aren't indexed"""
+        positions = self.positions
+        return [math.dist(point, positions[systemId]) if systemId in positions else None for systemId in systemIds]
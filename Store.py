@@ -0,0 +1,340 @@
+import os
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import fields, is_dataclass, asdict
+
+from Models import System, Station, Commodity, Listing, Category
+from Snapshot import writeSnapshot
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Store')
+
+
+def modelColumns(modelClass, skip=()):
+    return [field.name for field in fields(modelClass) if field.name not in skip]
+
+
+SYSTEM_COLUMNS = modelColumns(System)
+STATION_COLUMNS = modelColumns(Station)
+COMMODITY_COLUMNS = modelColumns(Commodity, skip=('category', )) + ['category_name']
+LISTING_COLUMNS = modelColumns(Listing, skip=('LEFT', 'RIGHT'))
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS systems ({', '.join(SYSTEM_COLUMNS)}, PRIMARY KEY (id));
+CREATE TABLE IF NOT EXISTS stations ({', '.join(STATION_COLUMNS)}, PRIMARY KEY (id));
+CREATE TABLE IF NOT EXISTS commodities ({', '.join(COMMODITY_COLUMNS)}, PRIMARY KEY (id));
+CREATE TABLE IF NOT EXISTS listings ({', '.join(LISTING_COLUMNS)}, PRIMARY KEY (station_id, commodity_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS systems_x ON systems (x);
+CREATE INDEX IF NOT EXISTS systems_name ON systems (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS stations_system ON stations (system_id);
+CREATE INDEX IF NOT EXISTS stations_market ON stations (ed_market_id);
+CREATE INDEX IF NOT EXISTS listings_sell ON listings (commodity_id, sell_price);
+CREATE INDEX IF NOT EXISTS listings_buy ON listings (commodity_id, buy_price);
+CREATE INDEX IF NOT EXISTS listings_collected ON listings (collected_at);
+CREATE TABLE IF NOT EXISTS sync_watermarks (source PRIMARY KEY, collected_at);
+CREATE TABLE IF NOT EXISTS imports (kind PRIMARY KEY, imported_at);
+'''
+# indexes on columns added after a release, created once the column is there (see MarketStore.migrate)
+LATER_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS systems_address ON systems (ed_system_address)',
+)
+GAME_ID_COLUMNS = ('ed_system_address', 'ed_market_id')  # an update without the game's id keeps the stored one
+# listings by station_id are served by the primary key
+BULK_DROPPED_INDEXES = ('listings_sell', 'listings_buy', 'listings_collected')  # rebuilt once after a bulk write
+
+
+class MarketStore:
+    """SQLite store for systems, stations, commodities and listings.
+
+    Each thread gets its own connection and the database runs in WAL mode, so the loop
+    worker can read while the market worker writes. Rows can be given as models or dicts.
+
+    Ids are eddb's, systems and stations only seen in the journal get negative ids from
+    `localId` and are folded into the eddb rows by `mergeLocalRows` once those arrive.
+    """
+
+    def __init__(self, path, batchSize=5000) -> None:
+        self.path = path
+        self.batchSize = batchSize
+        self.local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+            self.migrate(connection)
+
+    def migrate(self, connection):
+        """Add the model columns an older database is missing"""
+        added = set()
+        for table, columns in (('systems', SYSTEM_COLUMNS), ('stations', STATION_COLUMNS)):
+            existing = {row['name'] for row in connection.execute(f'PRAGMA table_info({table})')}
+            for column in columns:
+                if column not in existing:
+                    connection.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+                    added.add(column)
+        for sql in LATER_INDEXES:
+            connection.execute(sql)
+        if 'ed_system_address' in added:
+            self.moveGameIds(connection)
+
+    def moveGameIds(self, connection):
+        """Stores from before ed_system_address kept journal systems and stations under the game's ids, give them local ids.
+
+        SystemAddresses are far above eddb's system ids and those stations have their MarketID as id.
+        """
+        for table, gameColumn, where, child in (('systems', 'ed_system_address', 'id > 2147483647', ('stations', 'system_id')),
+                                                ('stations', 'ed_market_id', 'id = ed_market_id', ('listings', 'station_id'))):
+            nextId = connection.execute(f'SELECT MIN(COALESCE(MIN(id), 0), 0) - 1 FROM {table}').fetchone()[0]
+            for (gameId, ) in connection.execute(f'SELECT id FROM {table} WHERE {where}').fetchall():
+                connection.execute(f'UPDATE {table} SET id = ?, {gameColumn} = ? WHERE id = ?', (nextId, gameId, gameId))
+                connection.execute(f'UPDATE {child[0]} SET {child[1]} = ? WHERE {child[1]} = ?', (nextId, gameId))
+                nextId = nextId - 1
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA cache_size=-32768')  # 32MB, keeps the listing indexes in memory during bulk writes
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    # Writing
+
+    def upsert(self, table, columns, rows, conflict='id'):
+        """Insert or update rows in batched transactions, returns the number of rows written"""
+        rows = (asdict(row) if is_dataclass(row) else row for row in rows)
+        return self.upsertValues(table, columns, ([row.get(column) for column in columns] for row in rows), conflict)
+
+    def upsertValues(self, table, columns, rows, conflict='id'):
+        """upsert for rows that are already lists of values in `columns` order"""
+        updates = ', '.join(f'{column}=COALESCE(excluded.{column}, {table}.{column})' if column in GAME_ID_COLUMNS
+                            else f'{column}=excluded.{column}' for column in columns if column not in conflict.split(', '))
+        sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) ' \
+              f'ON CONFLICT ({conflict}) DO UPDATE SET {updates}'
+        connection = self.connection()
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batchSize:
+                with connection:
+                    connection.executemany(sql, batch)
+                count = count + len(batch)
+                batch = []
+        if batch:
+            with connection:
+                connection.executemany(sql, batch)
+            count = count + len(batch)
+        return count
+
+    def localId(self, table):
+        """An id for a system or station eddb doesn't know, eddb's ids are all positive"""
+        return self.query(f'SELECT MIN(COALESCE(MIN(id), 0), 0) - 1 AS id FROM {table}')[0]['id']
+
+    def mergeLocalRows(self):
+        """Fold the systems and stations learned from the journal into eddb's rows for them.
+
+        Call after importing systems or stations. A journal listing replaces eddb's for the
+        same commodity when it is at least as recent. Returns the number of rows merged.
+        """
+        connection = self.connection()
+        merged = 0
+        with connection:
+            systems = connection.execute(
+                'SELECT local.id, known.id, local.ed_system_address FROM systems AS local '
+                'JOIN systems AS known ON known.name = local.name COLLATE NOCASE AND known.id > 0 WHERE local.id < 0').fetchall()
+            for localId, knownId, address in systems:
+                connection.execute('UPDATE systems SET ed_system_address = COALESCE(ed_system_address, ?) WHERE id = ?', (address, knownId))
+                connection.execute('UPDATE stations SET system_id = ? WHERE system_id = ?', (knownId, localId))
+                connection.execute('DELETE FROM systems WHERE id = ?', (localId, ))
+            stations = connection.execute(
+                'SELECT local.id, known.id, local.ed_market_id FROM stations AS local '
+                'JOIN stations AS known ON known.id > 0 AND (known.ed_market_id = local.ed_market_id '
+                'OR (known.system_id = local.system_id AND known.name = local.name COLLATE NOCASE)) WHERE local.id < 0').fetchall()
+            for localId, knownId, marketId in stations:
+                connection.execute('UPDATE stations SET ed_market_id = COALESCE(ed_market_id, ?) WHERE id = ?', (marketId, knownId))
+                connection.execute('DELETE FROM listings WHERE station_id = ? AND EXISTS (SELECT 1 FROM listings AS local '
+                                   'WHERE local.station_id = ? AND local.commodity_id = listings.commodity_id '
+                                   'AND local.collected_at >= listings.collected_at)', (knownId, localId))
+                connection.execute('UPDATE OR IGNORE listings SET station_id = ? WHERE station_id = ?', (knownId, localId))
+                connection.execute('DELETE FROM listings WHERE station_id = ?', (localId, ))
+                connection.execute('DELETE FROM stations WHERE id = ?', (localId, ))
+            merged = len(systems) + len(stations)
+        if merged:
+            logger.info(f'Merged {len(systems)} systems and {len(stations)} stations seen in the journal into eddb rows')
+        return merged
+
+    def upsertSystems(self, systems):
+        return self.upsert('systems', SYSTEM_COLUMNS, systems)
+
+    def upsertStations(self, stations):
+        return self.upsert('stations', STATION_COLUMNS, stations)
+
+    def upsertCommodities(self, commodities):
+        def flatten(commodity):
+            row = asdict(commodity) if is_dataclass(commodity) else dict(commodity)
+            category = row.pop('category', None) or {}
+            row['category_name'] = category.get('name')
+            return row
+        return self.upsert('commodities', COMMODITY_COLUMNS, map(flatten, commodities))
+
+    def upsertListings(self, listings):
+        return self.upsert('listings', LISTING_COLUMNS, listings, conflict='station_id, commodity_id')
+
+    def syncListings(self, listings):
+        """Upsert listings, but never over a listing collected more recently. Returns the rows changed"""
+        updates = ', '.join(f'{column}=excluded.{column}' for column in LISTING_COLUMNS if column not in ('station_id', 'commodity_id'))
+        sql = f'INSERT INTO listings ({", ".join(LISTING_COLUMNS)}) VALUES ({", ".join("?" * len(LISTING_COLUMNS))}) ' \
+              f'ON CONFLICT (station_id, commodity_id) DO UPDATE SET {updates} WHERE excluded.collected_at > listings.collected_at'
+        connection = self.connection()
+        before = connection.total_changes
+        with connection:
+            connection.executemany(sql, [[row.get(column) for column in LISTING_COLUMNS]
+                                         for row in (asdict(listing) if is_dataclass(listing) else listing for listing in listings)])
+        return connection.total_changes - before
+
+    def pruneListings(self, olderThan):
+        """Delete listings collected before `olderThan`, returns how many went"""
+        with self.connection() as connection:
+            return connection.execute('DELETE FROM listings WHERE collected_at < ?', (olderThan, )).rowcount
+
+    def watermark(self, source):
+        """Newest collected_at synced from `source`, 0 if it was never synced"""
+        rows = self.query('SELECT collected_at FROM sync_watermarks WHERE source = ?', (source, ))
+        return rows[0]['collected_at'] if rows else 0
+
+    def importedAt(self, kind):
+        """When a dump of `kind` (see Import.KINDS) was last imported, 0 if one never was"""
+        rows = self.query('SELECT imported_at FROM imports WHERE kind = ?', (kind, ))
+        return rows[0]['imported_at'] if rows else 0
+
+    def markImported(self, kind, importedAt):
+        with self.connection() as connection:
+            connection.execute('INSERT INTO imports (kind, imported_at) VALUES (?, ?) '
+                               'ON CONFLICT (kind) DO UPDATE SET imported_at=excluded.imported_at', (kind, importedAt))
+
+    def setWatermark(self, source, collectedAt):
+        with self.connection() as connection:
+            connection.execute('INSERT INTO sync_watermarks (source, collected_at) VALUES (?, ?) '
+                               'ON CONFLICT (source) DO UPDATE SET collected_at=excluded.collected_at', (source, collectedAt))
+
+    @contextmanager
+    def bulkWrites(self):
+        """For writing millions of rows: the listing price indexes are dropped and built again
+        once at the end, and sqlite doesn't wait for the disk after every transaction.
+        """
+        connection = self.connection()
+        connection.execute('PRAGMA synchronous=OFF')
+        for index in BULK_DROPPED_INDEXES:
+            connection.execute(f'DROP INDEX IF EXISTS {index}')
+        try:
+            yield self
+        finally:
+            connection.executescript(SCHEMA)
+            connection.execute('PRAGMA synchronous=NORMAL')
+
+    def replaceStationListings(self, stationId, listings):
+        """Swap a station's listings for a new set in one transaction"""
+        connection = self.connection()
+        rows = [asdict(listing) if is_dataclass(listing) else listing for listing in listings]
+        with connection:
+            connection.execute('DELETE FROM listings WHERE station_id = ?', (stationId, ))
+            connection.executemany(
+                f'INSERT INTO listings ({", ".join(LISTING_COLUMNS)}) VALUES ({", ".join("?" * len(LISTING_COLUMNS))})',
+                [[row.get(column) for column in LISTING_COLUMNS] for row in rows])
+
+    # Reading
+
+    def query(self, sql, params=()):
+        return [dict(row) for row in self.connection().execute(sql, params)]
+
+    def inClause(self, values):
+        return ', '.join('?' * len(values))
+
+    def queryIn(self, sql, values, params=(), chunkSize=500):
+        """Run a query with an `IN ({})` clause in chunks so it stays under sqlite's variable limit"""
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), chunkSize):
+            chunk = values[start:start + chunkSize]
+            rows.extend(self.query(sql.format(self.inClause(chunk)), chunk + list(params)))
+        return rows
+
+    def systemByName(self, name):
+        """eddb's row for the system if there is one, before any learned from the journal"""
+        rows = self.query('SELECT * FROM systems WHERE name = ? COLLATE NOCASE ORDER BY id < 0 LIMIT 1', (name, ))
+        return rows[0] if rows else None
+
+    def systemByAddress(self, address):
+        rows = self.query('SELECT * FROM systems WHERE ed_system_address = ? ORDER BY id < 0 LIMIT 1', (address, ))
+        return rows[0] if rows else None
+
+    def systemsNear(self, point, radius, since=None):
+        """Systems within `radius` ly of `point`, the x index narrows the scan to a slab first"""
+        x, y, z = point
+        return self.query(
+            'SELECT * FROM systems WHERE x BETWEEN ? AND ? AND y BETWEEN ? AND ? AND z BETWEEN ? AND ? '
+            'AND (x - ?) * (x - ?) + (y - ?) * (y - ?) + (z - ?) * (z - ?) <= ? AND updated_at >= ?',
+            (x - radius, x + radius, y - radius, y + radius, z - radius, z + radius, x, x, y, y, z, z, radius * radius,
+             since or 0))
+
+    def stationsInSystems(self, systemIds, since=None):
+        return self.queryIn('SELECT * FROM stations WHERE system_id IN ({}) AND updated_at >= ?', systemIds, (since or 0, ))
+
+    def stationNames(self):
+        """id, ed_market_id, name and system_name of every station, for a StationLookup"""
+        return self.query('SELECT stations.id, stations.ed_market_id, stations.name, systems.name AS system_name '
+                          'FROM stations JOIN systems ON systems.id = stations.system_id')
+
+    def stationByMarketId(self, marketId):
+        rows = self.query('SELECT * FROM stations WHERE ed_market_id = ?', (marketId, ))
+        return rows[0] if rows else None
+
+    def listingsForStations(self, stationIds, since=0):
+        return self.queryIn('SELECT * FROM listings WHERE station_id IN ({}) AND collected_at >= ?', stationIds, (since, ))
+
+    def bestSellPrices(self, commodityId, limit=10, minDemand=0):
+        """Listings paying the most for a commodity"""
+        return self.query(
+            'SELECT * FROM listings WHERE commodity_id = ? AND demand >= ? ORDER BY sell_price DESC LIMIT ?',
+            (commodityId, minDemand, limit))
+
+    def bestBuyPrices(self, commodityId, limit=10, minSupply=1):
+        """Cheapest listings to buy a commodity from"""
+        return self.query(
+            'SELECT * FROM listings WHERE commodity_id = ? AND buy_price > 0 AND supply >= ? ORDER BY buy_price LIMIT ?',
+            (commodityId, minSupply, limit))
+
+    def listingsSince(self, collectedAt):
+        return self.query('SELECT * FROM listings WHERE collected_at >= ?', (collectedAt, ))
+
+    def commodities(self):
+        commodities = dict()
+        for row in self.query('SELECT * FROM commodities'):
+            categoryName = row.pop('category_name')
+            row['category'] = Category(row['category_id'], categoryName)
+            commodity = Commodity(**row)
+            commodities[commodity.id] = commodity
+        return commodities
+
+    def writeSnapshot(self, path):
+        """Write every system and station to a memory mappable snapshot, see Snapshot.py"""
+        writeSnapshot(path, self.query('SELECT * FROM systems'), self.query('SELECT * FROM stations'))
+
+    def area(self, point, radius, since=0):
+        """Systems, stations and listings within `radius` of `point`, ready for LoopSearch.load"""
+        systems = self.systemsNear(point, radius)
+        stations = self.stationsInSystems(system['id'] for system in systems)
+        listings = self.listingsForStations((station['id'] for station in stations), since)
+        return systems, stations, listings
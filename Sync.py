@@ -0,0 +1,87 @@
+import csv
+import time
+import logging
+from dataclasses import dataclass
+
+from Store import LISTING_COLUMNS
+from Import import columnTypes, convert
+from Metrics import metrics
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Sync')
+
+
+@dataclass
+class SyncReport:
+    source: str
+    received: int = 0  # listings in the download
+    skipped: int = 0  # older than the watermark
+    changed: int = 0  # rows inserted or updated in the store
+    pruned: int = 0  # rows deleted for being older than the price age
+    watermark: int = 0  # newest collected_at seen, where the next sync starts from
+    seconds: float = 0
+
+    def __str__(self):
+        return (f'{self.source}: {self.changed} changed, {self.skipped} skipped of {self.received} listings, '
+                f'{self.pruned} pruned in {self.seconds:.1f}s')
+
+
+class ListingSync:
+    """Keeps the store's listings up to date from a csv listings feed.
+
+    Every source has a high-water mark on collected_at. Rows older than it are dropped
+    while the csv is read, before any are converted, and the rest are upserted so a row
+    never replaces one collected more recently. The database work of a sync is therefore
+    proportional to what changed, not to the size of the market.
+    """
+
+    def __init__(self, store, http, batchSize=5000) -> None:
+        self.store = store
+        self.http = http
+        self.batchSize = batchSize
+
+    def sync(self, url, priceAge=None):
+        """Apply the listings at `url` that are newer than the last sync of it.
+
+        Listings older than `priceAge` days are pruned afterwards, if it's given.
+        """
+        start = time.perf_counter()
+        report = SyncReport(url, watermark=self.store.watermark(url))
+        response = self.http.get(url, stream=True)
+        response.raise_for_status()
+        try:
+            lines = (line.decode('utf-8') for line in response.iter_lines() if line)
+            self.apply(csv.reader(lines), report)
+        finally:
+            response.close()
+        if priceAge:
+            report.pruned = self.store.pruneListings(time.time() - priceAge * 86400)
+        report.seconds = time.perf_counter() - start
+        for name in ('received', 'skipped', 'changed', 'pruned'):
+            metrics.count(f'sync.{name}', getattr(report, name))
+        logger.info(f'Listing sync {report}')
+        return report
+
+    def apply(self, rows, report):
+        """Upsert the csv rows (header first) not older than the report's watermark, raising the watermark as it goes"""
+        header = next(rows)
+        collectedIndx = header.index('collected_at')
+        since = report.watermark
+        types = dict(zip(LISTING_COLUMNS, columnTypes('listings')))
+        columns = [(indx, name, types[name]) for indx, name in enumerate(header) if name in types]
+        batch = []
+        for row in rows:
+            report.received = report.received + 1
+            collectedAt = int(row[collectedIndx])
+            if collectedAt < since:  # rows at the watermark may have arrived after the last sync
+                report.skipped = report.skipped + 1
+                continue
+            batch.append({name: convert(row[indx], valueType) for indx, name, valueType in columns})
+            report.watermark = max(report.watermark, collectedAt)
+            if len(batch) >= self.batchSize:
+                report.changed = report.changed + self.store.syncListings(batch)
+                batch = []
+        if batch:
+            report.changed = report.changed + self.store.syncListings(batch)
+        self.store.setWatermark(report.source, report.watermark)
+        return report
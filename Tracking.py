@@ -0,0 +1,134 @@
+import logging
+from dataclasses import dataclass
+
+from Lookup import StationLookup
+
+from EDMCLogging import get_main_logger
+logger = logging.getLogger('EDMC-Trade-Tracker.Tracking')
+
+
+@dataclass
+class LapResult:
+    lap: int
+    expected: int  # profit the route's prices promised for the units bought
+    realized: int  # profit actually made selling them
+
+
+class RouteTracker:
+    """Follows the commander along a list of Route stops (see Loop.route) from journal events.
+
+    Stations are looked up in a StationLookup of the route's stops and commodities in the
+    catalogue's CommodityLookup, so each event costs a few dict lookups however long the
+    route or the journal is. `handle` returns whether anything shown in the status
+    changed, so the caller only re-renders then.
+    """
+
+    def __init__(self, stops, commodities) -> None:
+        self.stops = stops
+        self.commodities = commodities
+        self.legs = [indx for indx, stop in enumerate(stops) if stop.commodity]  # stops where something is bought
+        self.stations = StationLookup()  # station -> index of its first stop
+        self.stopsAt = dict()  # index of a station's first stop -> indices of all its stops
+        for indx, stop in enumerate(stops):
+            first = self.stations.find(stop.station.ed_market_id, stop.system.name, stop.station.name)
+            if first is None:
+                first = indx
+                self.stations.add(indx, stop.station.ed_market_id, stop.system.name, stop.station.name)
+            self.stopsAt.setdefault(first, set()).add(indx)
+        self.leg = 0  # index into self.legs
+        self.lap = 1
+        self.cargo = 0  # units of the leg's commodity on board
+        self.expected = 0  # this lap
+        self.realized = 0  # this lap
+        self.laps = []  # LapResult of every finished lap
+        self.system = None
+        self.dockedStops = set()
+        self.handlers = {
+            'Location': self.onLocation,
+            'FSDJump': self.onJump,
+            'CarrierJump': self.onJump,
+            'Docked': self.onDocked,
+            'Undocked': self.onUndocked,
+            'MarketBuy': self.onBuy,
+            'MarketSell': self.onSell
+        }
+
+    def handle(self, entry):
+        handler = self.handlers.get(entry['event'])
+        return handler(entry) if handler else False
+
+    def buyStop(self):
+        return self.legs[self.leg]
+
+    def sellStop(self):
+        """The stop the current leg's cargo is sold at, loops wrap round to the first stop"""
+        return (self.legs[self.leg] + 1) % len(self.stops)
+
+    def commodityMatches(self, stopIndx, entry):
+        commodity = self.commodities.resolve(symbol=entry.get('Type'), name=entry.get('Type_Localised'))
+        return commodity is not None and commodity.id == self.stops[stopIndx].commodity.id
+
+    def onLocation(self, entry):
+        changed = self.onJump(entry)
+        if entry.get('Docked'):
+            changed = self.onDocked(entry) or changed
+        return changed
+
+    def onJump(self, entry):
+        self.system = entry['StarSystem']
+        self.dockedStops = set()
+        return True
+
+    def onDocked(self, entry):
+        first = self.stations.find(entry.get('MarketID'), entry.get('StarSystem'), entry.get('StationName'))
+        stops = self.stopsAt.get(first, set())
+        changed = stops != self.dockedStops
+        self.dockedStops = stops
+        return changed
+
+    def onUndocked(self, entry):
+        changed = bool(self.dockedStops)
+        self.dockedStops = set()
+        return changed
+
+    def onBuy(self, entry):
+        stopIndx = self.buyStop()
+        if stopIndx not in self.dockedStops or not self.commodityMatches(stopIndx, entry):
+            return False
+        self.cargo = self.cargo + entry['Count']
+        self.expected = self.expected + self.stops[stopIndx].profit * entry['Count']
+        return True
+
+    def onSell(self, entry):
+        if self.sellStop() not in self.dockedStops or not self.commodityMatches(self.buyStop(), entry):
+            return False
+        self.realized = self.realized + entry['TotalSale'] - entry.get('AvgPricePaid', 0) * entry['Count']
+        self.cargo = self.cargo - entry['Count']
+        if self.cargo <= 0:
+            self.nextLeg()
+        return True
+
+    def nextLeg(self):
+        self.cargo = 0
+        self.leg = self.leg + 1
+        if self.leg == len(self.legs):
+            self.laps.append(LapResult(self.lap, self.expected, self.realized))
+            logger.info(f'Finished lap {self.lap}: {self.realized}Cr of {self.expected}Cr expected')
+            self.lap = self.lap + 1
+            self.leg = 0
+            self.expected = 0
+            self.realized = 0
+
+    def statusText(self):
+        if not self.legs:
+            return 'Nothing to trade on this route'
+        stopIndx = self.sellStop() if self.cargo else self.buyStop()
+        stop = self.stops[stopIndx]
+        action = 'Sell' if self.cargo else 'Buy'
+        commodity = self.stops[self.buyStop()].commodity.name
+        where = 'here' if stopIndx in self.dockedStops else f'at {stop.station.name} ({stop.system.name})'
+        text = f'Lap {self.lap} leg {self.leg + 1}/{len(self.legs)}: {action} {commodity} {where}\n' \
+               f'Profit {self.realized:,}Cr of {self.expected:,}Cr expected'
+        if self.laps:
+            text = f'{text}, last lap {self.laps[-1].realized:,}Cr'
+        return text
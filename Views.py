@@ -1,6 +1,10 @@
 
+import time
 import logging
+import itertools
+import threading
 import tkinter as tk
+from collections import OrderedDict
 from functools import partial
 import logging
 from tkinter.ttk import Button
@@ -18,6 +22,77 @@ class View:
     def hide(self):
         pass
 
+class UiQueue:
+    """Runs updates posted from worker threads on the Tk thread.
+
+    Tk isn't thread safe, so workers post callables here and the Tk thread runs every
+    pending one in a single batch each `interval` ms. An update posted with a key replaces
+    any pending update with the same key, so a burst of refreshes only renders once.
+    """
+    def __init__(self, interval=50) -> None:
+        self.interval = interval
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.widget = None
+
+    def post(self, func, key=None):
+        if key is None:
+            key = next(self.counter)
+        with self.lock:
+            self.pending.pop(key, None)
+            self.pending[key] = func
+
+    def start(self, widget):
+        """Start draining, must be called from the Tk thread"""
+        self.widget = widget
+        self.widget.after(self.interval, self.drain)
+
+    def drain(self):
+        with self.lock:
+            batch = list(self.pending.values())
+            self.pending.clear()
+        for func in batch:
+            try:
+                func()
+            except Exception:
+                logger.exception('UI update failed')
+        self.widget.after(self.interval, self.drain)
+
+class Ticker:
+    """One Tk timer shared by everything on a page that changes as time passes.
+
+    Each tick calls `func(now)` once, which refreshes what it shows in a single batch and
+    returns the seconds until any of it could change, the timer then sleeps that long
+    (within `minInterval` and `maxInterval`). Only start and stop it on the Tk thread.
+    """
+    def __init__(self, func, minInterval=1, maxInterval=60) -> None:
+        self.func = func
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.widget = None
+        self.job = None
+
+    def start(self, widget):
+        if self.job is None:
+            self.widget = widget
+            self.tick()
+
+    def stop(self):
+        if self.job is not None:
+            self.widget.after_cancel(self.job)
+            self.job = None
+
+    def tick(self):
+        self.job = None
+        try:
+            delay = self.func(time.time())
+        except Exception:
+            logger.exception('Ticker update failed')
+            delay = self.maxInterval
+        delay = min(max(delay, self.minInterval), self.maxInterval)
+        self.job = self.widget.after(int(delay * 1000), self.tick)
+
 class HomeView:
     def __init__(self, buttons) -> None:
         self.buttons = buttons
@@ -42,39 +117,135 @@ class LoadingView:
         self.loadingLabel.grid_forget()
 
 class LoopsView:
-    # TOD: handle when ttal loops decreas
-    def __init__(self):
+    """Shows the loop lines in their own frame, with paging and sort controls under them.
+
+    Showing and hiding the page only grids the frame, and a refresh only grids lines that
+    weren't shown before, so updating the loops never re-grids the rest of the page.
+    Changing page or sort reuses the same lines, the callbacks refill them. The listing
+    ages of the shown lines are kept current by one ticker that only runs while the page
+    is shown.
+    """
+    def __init__(self, parent, pageSize, sorts, sort, onPage, onSort):
+        self.frame = tk.Frame(parent)
         self.loops = []
-        self.currentLoops = 0
+        self.shownCount = 0  # lines currently gridded
+        self.placedCount = 0  # lines that have been gridded at least once
+        self.ticker = Ticker(self.refreshAges)
+        self.sortNames = {label: name for name, label in sorts.items()}
+        self.controls = tk.Frame(self.frame)
+        self.prevButton = tk.Button(self.controls, text="<", command=lambda: onPage(-1))
+        self.pageVar = tk.StringVar()
+        self.nextButton = tk.Button(self.controls, text=">", command=lambda: onPage(1))
+        self.sortVar = tk.StringVar(value=sorts[sort])
+        self.sortMenu = tk.OptionMenu(self.controls, self.sortVar, *sorts.values(),
+                                      command=lambda label: onSort(self.sortNames[label]))
+        self.prevButton.grid(row = 0, column = 0)
+        tk.Label(self.controls, textvariable=self.pageVar).grid(row = 0, column = 1)
+        self.nextButton.grid(row = 0, column = 2)
+        self.sortMenu.grid(row = 0, column = 3, sticky=tk.E)
+        self.controls.columnconfigure(3, weight=1)
+        self.controls.grid(row = pageSize * 3, columnspan=10, sticky=tk.EW)
         logger.info("Creating loops page")
 
     def show(self):
-        rowPos = 0
-        for loopIndx, loop in enumerate(self.loops):
-            # First Line
-            for labelIndx1, widget in enumerate(loop.line1Labels):
-                widget.label.grid(row = rowPos, column = labelIndx1, sticky=widget.alignment)
-            rowPos = rowPos + 1
-            # Second Line
-            for labelIndx2, widget in enumerate(loop.line2Labels):
-                widget.label.grid(row = rowPos, column = labelIndx2, sticky=widget.alignment)
-            loop.selectButton.grid(row=rowPos, column=len(loop.line2Labels), sticky=tk.E)
-            rowPos = rowPos + 1
-            loop.separator.grid(columnspan=10, sticky=tk.EW, row=rowPos)
-            rowPos = rowPos + 1
+        self.frame.grid(row = 0, column = 0, sticky=tk.EW)
+        self.ticker.start(self.frame)
 
     def hide(self):
-        for loop in enumerate(self.loops):
-            for widget in enumerate(loop.line1Labels):
-                widget.label.grid_forget()
-            for widget in enumerate(loop.line2Labels):
-                widget.label.grid_forget()
-            loop.selectButton.grid_forget()
-            loop.separator.grid_forget()
-        pass
+        self.ticker.stop()
+        self.frame.grid_forget()
+
+    def refreshAges(self, now):
+        return min((loop.updateAges(now) for loop in self.loops[:self.shownCount]), default=self.ticker.maxInterval)
+
+    def placeLoop(self, loopIndx, loop):
+        rowPos = loopIndx * 3
+        # First Line
+        for labelIndx1, widget in enumerate(loop.line1Labels):
+            widget.label.grid(row = rowPos, column = labelIndx1, sticky=widget.alignment)
+        rowPos = rowPos + 1
+        # Second Line
+        for labelIndx2, widget in enumerate(loop.line2Labels):
+            widget.label.grid(row = rowPos, column = labelIndx2, sticky=widget.alignment)
+        loop.selectButton.grid(row=rowPos, column=len(loop.line2Labels), sticky=tk.E)
+        rowPos = rowPos + 1
+        loop.separator.grid(columnspan=10, sticky=tk.EW, row=rowPos)
+
+    def loopWidgets(self, loop):
+        return [widget.label for widget in loop.line1Labels + loop.line2Labels] + [loop.selectButton, loop.separator]
 
-    def setLoops(self, loops):
+    def setLoops(self, loops, count=None):
+        """Show the first `count` of `loops`, the rest are kept but removed from the grid"""
+        count = len(loops) if count is None else count
         self.loops = loops
+        for loopIndx in range(self.shownCount, count):
+            if loopIndx < self.placedCount:
+                for widget in self.loopWidgets(loops[loopIndx]):
+                    widget.grid()  # grid_remove remembers where the widget was
+            else:
+                self.placeLoop(loopIndx, loops[loopIndx])
+        for loop in loops[count:self.shownCount]:
+            for widget in self.loopWidgets(loop):
+                widget.grid_remove()
+        self.placedCount = max(self.placedCount, count)
+        self.shownCount = count
+
+    def setPage(self, pageIndx, pageCount):
+        self.pageVar.set(f'{pageIndx + 1}/{pageCount}')
+        self.prevButton.configure(state=tk.NORMAL if pageIndx > 0 else tk.DISABLED)
+        self.nextButton.configure(state=tk.NORMAL if pageIndx < pageCount - 1 else tk.DISABLED)
+
+class TrackingView:
+    """One line status of the route being tracked, shown under whichever page is open"""
+    def __init__(self, parent, onStop) -> None:
+        self.frame = tk.Frame(parent)
+        self.statusVar = tk.StringVar()
+        self.status = None
+        tk.Label(self.frame, textvariable=self.statusVar, justify=tk.LEFT).grid(row = 0, column = 0, sticky=tk.W)
+        tk.Button(self.frame, text="Stop", command=onStop).grid(row = 0, column = 1, sticky=tk.E)
+        self.frame.columnconfigure(0, weight=1)
+
+    def show(self):
+        self.frame.grid(row = 1, column = 0, sticky=tk.EW)
+
+    def hide(self):
+        self.frame.grid_forget()
+
+    def setStatus(self, status):
+        if status != self.status:
+            self.status = status
+            self.statusVar.set(status)
+
+class RoutesView:
+    """Routes from the multi hop planner, each with a button to track it.
+
+    A search only shows a handful of routes, so each render simply rebuilds the lines.
+    """
+    def __init__(self, parent, onSelect, onHome) -> None:
+        self.frame = tk.Frame(parent)
+        self.onSelect = onSelect
+        self.routesFrame = None
+        tk.Button(self.frame, text="Home", command=onHome).grid(row = 1, column = 0, sticky=tk.W)
+        self.frame.columnconfigure(0, weight=1)
+
+    def show(self):
+        self.frame.grid(row = 0, column = 0, sticky=tk.EW)
+
+    def hide(self):
+        self.frame.grid_forget()
+
+    def setRoutes(self, texts):
+        """Show one block of text per route, see Models.routeText"""
+        if self.routesFrame:
+            self.routesFrame.destroy()
+        self.routesFrame = tk.Frame(self.frame)
+        self.routesFrame.grid(row = 0, column = 0, sticky=tk.EW)
+        self.routesFrame.columnconfigure(0, weight=1)
+        if not texts:
+            tk.Label(self.routesFrame, text="No routes found, dock or jump near some markets first").grid(row = 0, column = 0, sticky=tk.W)
+        for indx, text in enumerate(texts):
+            tk.Label(self.routesFrame, text=f'{indx + 1}. {text}', justify=tk.LEFT).grid(row = indx, column = 0, sticky=tk.W)
+            tk.Button(self.routesFrame, text="Select", command=partial(self.onSelect, indx)).grid(row = indx, column = 1, sticky=tk.NE)
 
 class TestView:
     def __init__(self, logger) -> None:
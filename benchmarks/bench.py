@@ -0,0 +1,264 @@
+"""Benchmarks for the parse -> rank -> render pipeline.
+
+Run from the plugin folder:
+
+    python benchmarks/bench.py                                   # print timings
+    python benchmarks/bench.py --save benchmarks/baseline.json   # store a new baseline
+    python benchmarks/bench.py --compare benchmarks/baseline.json
+
+Each stage is timed as the best of a few batches, quick stages run many times per batch.
+A comparison exits with status 1 when a stage is still slower or uses more peak memory than
+the baseline by more than the tolerance after being measured again (--confirm), timings on
+a busy machine drift by half from one second to the next. Any run exits with 1 when a
+stage misses its time in BUDGETS (a 4 hop round trip has to be planned within a second).
+The render stages need a display and are skipped without one.
+"""
+import os
+import sys
+import gc
+import json
+import math
+import time
+import heapq
+import argparse
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), os.path.join(HERE, 'stubs')]
+
+import generate
+import Helpers
+from Models import Loop, Commodity, LoopRanking
+from Search import LoopSearch
+from Snapshot import Snapshot, writeSnapshot
+from Scoring import LoopScores, ScoringSettings
+
+CHUNK_SIZE = 64 * 1024
+SHOWN = 5
+BUDGETS = {'routeSearch': 1.0}  # seconds a stage has to finish in, whatever the baseline
+
+
+def measure(func, repeat, minBatch=0.05):
+    """Best seconds per run over `repeat` batches, and the peak traced memory of one more run in KB
+
+    Stages quicker than `minBatch` seconds are run that many times over per batch, a single
+    run of a millisecond stage is mostly timer and scheduler noise.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    func()
+    number = max(1, math.ceil(minBatch / max(time.perf_counter() - start, 1e-6)))
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': round(min(timings), 6), 'peakKb': round(peak / 1024)}
+
+
+def chunks(data):
+    return [data[start:start + CHUNK_SIZE] for start in range(0, len(data), CHUNK_SIZE)]
+
+
+def loopStages(size):
+    """Stages that scale with the number of loops in a response"""
+    raw = json.dumps(generate.loops(size)).encode('utf-8')
+    parts = chunks(raw)
+    decoded = json.loads(raw)
+    built = [Loop(**loop) for loop in decoded]
+    scores = LoopScores(built)
+    ship = ScoringSettings(cargoCapacity=256, jumpRange=20)
+
+    def materialize():
+        for loop in built[:SHOWN]:
+            for name in loop.fields:
+                getattr(loop, name)
+            loop.oneBuyListing.timeAgo()
+            loop.min_distance_str()
+
+    return {
+        'decodeJson': lambda: json.loads(raw),
+        'decodeStream': lambda: list(Helpers.iterJsonArray(parts)),
+        'buildLoops': lambda: [Loop(**loop) for loop in json.loads(raw)],
+        'streamLoops': lambda: [Loop(**loop) for loop in Helpers.iterJsonArray(parts)],
+        'rankProfit': lambda: sorted(built, key=Loop.profit, reverse=True),
+        'rankTopK': lambda: heapq.nlargest(SHOWN, built, key=Loop.profit),
+        'rankPages': lambda: [LoopRanking(built, sort).page(page, SHOWN) for sort in ('profitPerLy', 'distance') for page in range(3)],
+        'scoreLoops': lambda: scores.apply(ship),
+        'materializeShown': materialize
+    }
+
+
+def fixedStages():
+    """Stages whose input doesn't depend on the loop count"""
+    catalogue = generate.commodities()
+    systems, stations, listings = generate.market()
+    commodities = {commodity['id']: Commodity(**commodity) for commodity in catalogue}
+    search = LoopSearch()
+    search.load(*generate.bubble(), commodities)  # searches are timed at the density players trade in
+    area = dict(hopDistance=23, minSupply=100, priceAge=2, minProfit=1000, maxDistance=150)  # the plugin's hopDist
+    snapshotPath = os.path.join(tempfile.mkdtemp(), 'systems.snapshot')
+    writeSnapshot(snapshotPath, systems, stations)
+    snapshot = Snapshot(snapshotPath)
+
+    def openSnapshot():
+        Snapshot(snapshotPath).close()
+
+    def localSearch():
+        search.matrix = None  # build the station pairs, a search with the same settings only ranks them
+        search.search(1, **area)
+
+    def updateStation():
+        if search.matrix is None:
+            search.search(1, **area)
+        search.updateMatrix(next(iter(search.matrix.candidates)))
+
+    return {
+        'buildCommodities': lambda: [Commodity(**commodity) for commodity in catalogue],
+        'loadSearch': lambda: LoopSearch().load(systems, stations, listings, commodities),
+        'localSearch': localSearch,
+        'cachedSearch': lambda: search.search(1, **area),
+        'matrixUpdateStation': updateStation,
+        'routeSearch': lambda: search.searchRoutes(1, hops=4, roundTrip=True, hopDistance=23, minSupply=100, priceAge=2, maxDistance=150),
+        'openSnapshot': openSnapshot,
+        'snapshotArea': lambda: snapshot.area((0, 0, 0), 150)
+    }
+
+
+def renderStages():
+    """LoopInfoLine and LoopsView work in a hidden Tk root, None without a display"""
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    root.withdraw()
+    from Models import LoopInfoLine, LOOP_SORTS
+    from Views import LoopsView
+
+    loops = [Loop(**loop) for loop in generate.loops(SHOWN * 2)]
+    view = LoopsView(root, SHOWN, {name: sort[0] for name, sort in LOOP_SORTS.items()}, 'profit', print, print)
+    lines = []
+
+    def createLines():
+        for line in lines:
+            for label in line.line1Labels + line.line2Labels:
+                label.label.destroy()
+            line.selectButton.destroy()
+            line.separator.destroy()
+        lines.clear()
+        for indx, loop in enumerate(loops[:SHOWN]):
+            lines.append(LoopInfoLine(loop, view.frame, str(indx + 1), None))
+        view.shownCount = view.placedCount = 0
+        view.setLoops(lines)
+        root.update_idletasks()
+
+    createLines()
+    page = [0]
+
+    def updateLines():
+        page[0] = 1 - page[0]
+        for indx, loop in enumerate(loops[page[0] * SHOWN:(page[0] + 1) * SHOWN]):
+            lines[indx].updateLine(loop, str(indx + 1), None)
+        view.setLoops(lines)
+        root.update_idletasks()
+
+    return {'createLines': createLines, 'updateLines': updateLines}
+
+
+def allStages(sizes):
+    """Every stage by name, the render stages only when there is a display"""
+    stages = dict()
+    for size in sizes:
+        for stage, func in loopStages(size).items():
+            stages[f'{stage}[{size}]'] = func
+    stages.update(fixedStages())
+    render = renderStages()
+    if render is None:
+        print('No display, skipping render stages')
+    else:
+        stages.update(render)
+    return stages
+
+
+def run(stages, repeat):
+    results = dict()
+    for stage, func in stages.items():
+        results[stage] = measure(func, repeat)
+        print(f'{stage}: {results[stage]}', flush=True)
+    return results
+
+
+def retime(stages, results, names, repeat):
+    """Measure the `names` stages again and keep the best of both, to tell a regression from a busy machine"""
+    for stage in names:
+        result = measure(stages[stage], repeat)
+        results[stage] = {key: min(results[stage][key], result[key]) for key in result}
+        print(f'{stage} again: {results[stage]}', flush=True)
+
+
+def compare(results, baseline, timeTolerance, memoryTolerance, minSeconds=0.001, minKb=16):
+    """Returns a list of (stage, regression) against the baseline, slowdowns under `minSeconds` and growth under `minKb` are noise"""
+    regressions = []
+    for stage, base in baseline['results'].items():
+        result = results.get(stage)
+        if result is None:
+            continue
+        if result['seconds'] > base['seconds'] * (1 + timeTolerance) and result['seconds'] - base['seconds'] > minSeconds:
+            regressions.append((stage, f'{stage} took {result["seconds"]}s, baseline {base["seconds"]}s'))
+        if result['peakKb'] > base['peakKb'] * (1 + memoryTolerance) and result['peakKb'] - base['peakKb'] > minKb:
+            regressions.append((stage, f'{stage} peaked at {result["peakKb"]}KB, baseline {base["peakKb"]}KB'))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='loop counts, up to 100000')
+    parser.add_argument('--repeat', type=int, default=5, help='batches to time each stage over, the best is kept')
+    parser.add_argument('--save', help='write the results to this baseline file')
+    parser.add_argument('--compare', help='baseline file to compare against')
+    parser.add_argument('--time-tolerance', type=float, default=0.5, help='allowed slowdown, 0.5 = 50%%')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2, help='allowed peak memory growth')
+    parser.add_argument('--min-seconds', type=float, default=0.001, help='ignore slowdowns smaller than this')
+    parser.add_argument('--min-kb', type=int, default=16, help='ignore peak memory growth smaller than this')
+    parser.add_argument('--confirm', type=int, default=3, help='times a stage that looks slower is measured again before it counts')
+    args = parser.parse_args()
+
+    stages = allStages(args.sizes)
+    results = run(stages, args.repeat)
+    overBudget = [f'{stage} took {results[stage]["seconds"]}s, budget {budget}s'
+                  for stage, budget in BUDGETS.items() if stage in results and results[stage]['seconds'] > budget]
+    for message in overBudget:
+        print(f'OVER BUDGET: {message}')
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as baselineFile:
+            json.dump({'python': sys.version.split()[0], 'results': results}, baselineFile, indent=4)
+        print(f'Saved baseline to {args.save}')
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as baselineFile:
+            baseline = json.load(baselineFile)
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance, args.min_seconds, args.min_kb)
+        for _ in range(args.confirm):
+            if not regressions:
+                break
+            retime(stages, results, {stage for stage, _ in regressions}, args.repeat)
+            regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance, args.min_seconds, args.min_kb)
+        for stage, regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+    if overBudget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Offline checks of HttpClient's failure handling against a local RecordedServer.
+
+Run from the plugin folder:
+
+    python benchmarks/checks.py
+
+Covers retrying 5xx replies, giving up once the retries are spent, timeouts, a close()
+cancelling a retry that is backing off, and gzip compressed and streamed replies. Exits
+with status 1 if any check fails.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+import traceback
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), os.path.join(HERE, 'stubs')]
+
+import requests
+
+import Helpers
+from Network import HttpClient
+from recorded import RecordedServer
+
+ITEMS = [{'id': indx, 'name': f'Item {indx}'} for indx in range(2000)]
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def retriesServerErrors():
+    with RecordedServer({('GET', '/flaky'): [(503, {}, b''), (502, {}, b''), (200, {}, {'ok': True})]}) as server:
+        client = HttpClient(backoff=0.01)
+        response = client.get(server.url('/flaky'))
+        expect(response.status_code == 200, f'expected 200 after retrying, got {response.status_code}')
+        expect(response.json() == {'ok': True}, 'wrong body after retrying')
+        expect(len(server.requests) == 3, f'expected 3 requests, server got {len(server.requests)}')
+        expect([metric.attempt for metric in client.metrics] == [0, 1, 2], 'attempts not recorded')
+
+
+def givesUpAfterRetries():
+    with RecordedServer({('GET', '/down'): [(500, {}, b'')]}) as server:
+        client = HttpClient(retries=2, backoff=0.01)
+        response = client.get(server.url('/down'))
+        expect(response.status_code == 500, f'expected the last 500 back, got {response.status_code}')
+        expect(len(server.requests) == 3, f'expected 3 requests, server got {len(server.requests)}')
+
+
+def timesOut():
+    with RecordedServer({('GET', '/slow'): [(200, {}, b'late')]}, delay=1) as server:
+        client = HttpClient(timeout=(1, 0.1), retries=1, backoff=0.01)
+        start = time.perf_counter()
+        try:
+            client.get(server.url('/slow'))
+        except requests.Timeout:
+            pass
+        else:
+            raise CheckFailed('a slow reply did not time out')
+        expect(time.perf_counter() - start < 1, 'timing out took too long')
+        expect(all(metric.error for metric in client.metrics), 'timeouts not recorded')
+
+
+def closeCancelsBackoff():
+    with RecordedServer({('GET', '/busy'): [(503, {}, b'')]}) as server:
+        client = HttpClient(backoff=30, maxBackoff=30)
+        errors = []
+
+        def fetch():
+            try:
+                client.get(server.url('/busy'))
+            except requests.ConnectionError as err:
+                errors.append(err)
+
+        thread = threading.Thread(target=fetch)
+        start = time.perf_counter()
+        thread.start()
+        time.sleep(0.2)  # the first attempt has failed and the retry is waiting
+        client.close()
+        thread.join(5)
+        expect(not thread.is_alive(), 'close() did not cancel the backoff')
+        expect(errors, 'a cancelled request did not raise ConnectionError')
+        expect(time.perf_counter() - start < 5, 'cancelling took too long')
+
+
+def decodesGzip():
+    with RecordedServer({('GET', '/items'): [(200, {}, ITEMS)]}) as server:
+        client = HttpClient()
+        response = client.get(server.url('/items'))
+        expect(response.headers.get('Content-Encoding') == 'gzip', 'reply was not gzipped')
+        expect(response.json() == ITEMS, 'gzipped reply decoded wrong')
+
+        response = client.get(server.url('/items'), stream=True)
+        items = list(Helpers.iterJsonArray(response.iter_content(chunk_size=1024)))
+        response.close()
+        expect(items == ITEMS, 'streamed gzipped reply decoded wrong')
+
+
+CHECKS = [retriesServerErrors, givesUpAfterRetries, timesOut, closeCancelsBackoff, decodesGzip]
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)  # the retries log warnings
+    failed = 0
+    for check in CHECKS:
+        try:
+            check()
+            print(f'ok      {check.__name__}')
+        except Exception as err:
+            failed = failed + 1
+            print(f'FAILED  {check.__name__}: {err}')
+            if not isinstance(err, CheckFailed):
+                traceback.print_exc()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Synthetic eddb style data for the benchmarks.
+
+Every generator is seeded so two runs produce the same data, and the records have the
+same fields as the json the plugin gets from eddb (see Models.py).
+"""
+import random
+import time
+
+PAD_SIZES = 'SML'
+STATION_TYPES = (1, 3, 7, 8, 12, 13, 14, 24)
+NOW = int(time.time())
+
+
+def system(rand, systemId, spread=400):
+    return {
+        'id': systemId,
+        'name': f'Synthetic {systemId}',
+        'x': rand.uniform(-spread, spread),
+        'y': rand.uniform(-spread / 4, spread / 4),
+        'z': rand.uniform(-spread, spread),
+        'faction': 'Synthetic Faction',
+        'population': rand.randint(0, 10 ** 9),
+        'allegiance_id': rand.randint(1, 4),
+        'government_id': rand.randint(16, 208),
+        'needs_permit': False,
+        'updated_at': NOW,
+        'simbad_ref': '',
+        'is_populated': True
+    }
+
+
+def station(rand, stationId, systemId):
+    services = {name: rand.random() < 0.7 for name in (
+        'has_blackmarket', 'has_refuel', 'has_repair', 'has_rearm', 'has_outfitting', 'has_shipyard',
+        'has_docking', 'has_commodities', 'has_material_trader', 'has_technology_broker',
+        'has_carrier_vendor', 'has_carrier_administration', 'has_interstellar_factors',
+        'has_universal_cartographics', 'has_social_space')}
+    return {
+        'id': stationId,
+        'name': f'Station {stationId}',
+        'system_id': systemId,
+        'max_landing_pad_size': rand.choice(PAD_SIZES),
+        'distance_to_star': rand.randint(5, 50000),
+        'faction': 'Synthetic Faction',
+        'type_id': rand.choice(STATION_TYPES),
+        **services,
+        'updated_at': NOW,
+        'shipyard_updated_at': NOW,
+        'outfitting_updated_at': NOW,
+        'market_updated_at': NOW
+    }
+
+
+def commodity(commodityId):
+    return {
+        'id': commodityId,
+        'name': f'Commodity {commodityId}',
+        'category_id': commodityId % 15 + 1,
+        'average_price': commodityId * 100,
+        'is_rare': False,
+        'max_buy_price': commodityId * 150,
+        'max_sell_price': commodityId * 160,
+        'min_buy_price': commodityId * 50,
+        'min_sell_price': commodityId * 40,
+        'buy_price_lower_average': commodityId * 80,
+        'sell_price_upper_average': commodityId * 120,
+        'is_non_marketable': False,
+        'ed_id': 128000000 + commodityId,
+        'category': {'id': commodityId % 15 + 1, 'name': f'Category {commodityId % 15 + 1}'}
+    }
+
+
+def listing(rand, listingId, stationId, commodityId, exported):
+    base = commodityId * 100
+    return {
+        'id': listingId,
+        'station_id': stationId,
+        'commodity_id': commodityId,
+        'supply': rand.randint(0, 50000) if exported else 0,
+        'supply_bracket': 2 if exported else 0,
+        'buy_price': int(base * rand.uniform(0.6, 1.0)) if exported else 0,
+        'sell_price': int(base * rand.uniform(0.5, 1.5)),
+        'demand': 0 if exported else rand.randint(0, 50000),
+        'demand_bracket': 0 if exported else 2,
+        'collected_at': NOW - rand.randint(0, 86400 * 3)
+    }
+
+
+def commodities(count=350):
+    return [commodity(commodityId) for commodityId in range(1, count + 1)]
+
+
+def market(systemCount=2000, stationsPerSystem=3, commodityCount=350, listingsPerStation=60, spread=400, seed=1):
+    """Systems, stations and listings for the local search and store benchmarks"""
+    rand = random.Random(seed)
+    systems, stations, listings = [], [], []
+    for systemId in range(1, systemCount + 1):
+        systems.append(system(rand, systemId, spread))
+        for _ in range(stationsPerSystem):
+            stationId = len(stations) + 1
+            stations.append(station(rand, stationId, systemId))
+            for commodityId in rand.sample(range(1, commodityCount + 1), listingsPerStation):
+                listings.append(listing(rand, len(listings) + 1, stationId, commodityId, rand.random() < 0.5))
+    return systems, stations, listings
+
+
+def bubble(stationCount=20000, listingsPerStation=20, seed=1):
+    """A market as dense as the populated bubble, about `stationCount` stations within 200 ly.
+
+    System 1 is moved to the centre so searches around it see the whole density.
+    """
+    systems, stations, listings = market(systemCount=stationCount // 3, listingsPerStation=listingsPerStation, spread=200, seed=seed)
+    systems[0].update(x=0, y=0, z=0)
+    return systems, stations, listings
+
+
+def loops(count, seed=1):
+    """Loop json as returned by the eddb loops endpoint, sorted by profit"""
+    rand = random.Random(seed)
+    userSystem = system(rand, 1)
+    result = []
+    for loopId in range(1, count + 1):
+        oneSystem = system(rand, loopId * 2)
+        twoSystem = system(rand, loopId * 2 + 1)
+        oneStation = station(rand, loopId * 2, oneSystem['id'])
+        twoStation = station(rand, loopId * 2 + 1, twoSystem['id'])
+        oneCommodity = commodity(rand.randint(1, 350))
+        twoCommodity = commodity(rand.randint(1, 350))
+        result.append({
+            'oneBuyListing': listing(rand, loopId * 4, oneStation['id'], oneCommodity['id'], True),
+            'twoBuyListing': listing(rand, loopId * 4 + 1, twoStation['id'], twoCommodity['id'], True),
+            'oneSellListing': listing(rand, loopId * 4 + 2, oneStation['id'], twoCommodity['id'], False),
+            'twoSellListing': listing(rand, loopId * 4 + 3, twoStation['id'], oneCommodity['id'], False),
+            'oneStation': oneStation,
+            'twoStation': twoStation,
+            'oneSystem': oneSystem,
+            'twoSystem': twoSystem,
+            'oneCommodity': oneCommodity,
+            'twoCommodity': twoCommodity,
+            'distance': rand.uniform(1, 30),
+            'userSystem': userSystem,
+            'tradeLoopId': loopId
+        })
+    profit = lambda loop: (loop['twoSellListing']['sell_price'] - loop['oneBuyListing']['buy_price']
+                           + loop['oneSellListing']['sell_price'] - loop['twoBuyListing']['buy_price'])
+    result.sort(key=profit, reverse=True)
+    return result
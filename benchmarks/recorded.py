@@ -0,0 +1,90 @@
+"""Local stand in for the remote servers, for benchmarks/replay.py and benchmarks/checks.py"""
+import gzip
+import json
+import time
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger('EDMC-Trade-Tracker.Recorded')
+
+
+class RecordedServer:
+    """Local stand in for the remote servers that replies with recorded responses.
+
+    `routes` maps (method, path) to a list of (status, headers, body) replies which are
+    used in order, the last one repeating. Bodies that aren't bytes are sent as json and
+    are gzipped when the client accepts it. Every request received is kept in `requests`.
+    """
+
+    def __init__(self, routes=None, delay=0) -> None:
+        self.routes = {key: list(replies) for key, replies in (routes or {}).items()}
+        self.delay = delay
+        self.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handlerClass())
+        self.thread = None
+
+    def url(self, path=''):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}{path}'
+
+    def add(self, method, path, status=200, body=b'', headers=None):
+        self.routes.setdefault((method, path), []).append((status, headers or {}, body))
+
+    def nextReply(self, method, path):
+        replies = self.routes.get((method, path))
+        if not replies:
+            return 404, {}, b''
+        return replies.pop(0) if len(replies) > 1 else replies[0]
+
+    def handlerClass(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep alive, like the real servers
+
+            def reply(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                server.requests.append((self.command, self.path, dict(self.headers), body))
+                if server.delay:
+                    time.sleep(server.delay)
+                status, headers, replyBody = server.nextReply(self.command, self.path)
+                if not isinstance(replyBody, bytes):
+                    replyBody = json.dumps(replyBody).encode('utf-8')
+                    headers = {'Content-Type': 'application/json', **headers}
+                if replyBody and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    replyBody = gzip.compress(replyBody)
+                    headers = {'Content-Encoding': 'gzip', **headers}
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Length', str(len(replyBody)))
+                    self.end_headers()
+                    self.wfile.write(replyBody)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # the client gave up waiting, as in a timeout
+
+            do_GET = reply
+            do_POST = reply
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='Recorded server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
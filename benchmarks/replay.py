@@ -0,0 +1,180 @@
+"""Replays a recorded session against the plugin and reports its end to end latencies.
+
+Record a session by setting Trade-Tracker_recordSession to 1 in EDMC's config, it is
+written to cache/sessions/ in the plugin folder. Then from the plugin folder:
+
+    python benchmarks/replay.py cache/sessions/<session>.jsonl
+    python benchmarks/replay.py <session>.jsonl --speed 10 --cache cache --json timings.json
+
+The plugin is started against stubbed EDMC modules and a headless Tk root, journal events
+and "Loop Route" clicks are played back in order and every HTTP request is answered from
+the session by a local RecordedServer, so two replays of a session do the same work.
+`--speed 0` (the default) plays each record as soon as the plugin has finished with the
+one before, otherwise the recorded gaps are kept, divided by the speed. Tk needs a display,
+use xvfb-run where there isn't one.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import argparse
+import tempfile
+from urllib.parse import urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), os.path.join(HERE, 'stubs')]
+
+import tkinter as tk
+
+from config import config
+from Network import HttpClient
+from recorded import RecordedServer
+from Metrics import metrics
+from Session import readSession
+
+REPORTED = ('loops.clickToRender', 'routes.clickToRender', 'journal.eventToUpdate', 'loops.eventToRender', 'ui.render')
+SETTLE_TIMEOUT = 60  # seconds to wait for the plugin to finish with a record
+HTTP_KINDS = ('http', 'httpBody')  # records the RecordedServer answers with rather than played ones
+
+
+class ReplayClient(HttpClient):
+    """HttpClient that sends every request to the RecordedServer, whatever host it was for"""
+
+    def __init__(self, server, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.server = server
+
+    def request(self, method, url, **kwargs):
+        return super().request(method, self.server.url(pathOf(url)), **kwargs)
+
+
+def pathOf(url):
+    parts = urlsplit(url)
+    return f'{parts.path}?{parts.query}' if parts.query else parts.path
+
+
+def recordedServer(records):
+    """A RecordedServer giving each (method, path) its recorded responses in order"""
+    server = RecordedServer()
+    bodies = dict()  # streamed response id -> its 'httpBody' record, there is none when the body was never read
+    for record in records:
+        if record['kind'] == 'httpBody':
+            bodies.setdefault(record['id'], record)
+    for record in records:
+        if record['kind'] == 'http':
+            body = bodies.get(record['id'], record) if 'id' in record else record
+            if body.get('skipped'):
+                print(f'{record["url"]} was too big to record, it is replayed empty', file=sys.stderr)
+            server.add(record['method'], pathOf(record['url']), record['status'],
+                       base64.b64decode(body['body']), record.get('headers'))
+    return server
+
+
+def pump(root, seconds):
+    """Run the Tk event loop for `seconds`"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        root.update()
+        time.sleep(0.002)
+
+
+def settle(root, load):
+    """Run the Tk event loop until the workers are done with what has been played so far"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < SETTLE_TIMEOUT:
+        root.update()
+        busy = load.this.marketEvents.unfinished_tasks or load.this.currentPage == 'loading'
+        if not busy:
+            break
+        time.sleep(0.002)
+    else:
+        print(f'Gave up waiting for the plugin after {SETTLE_TIMEOUT}s', file=sys.stderr)
+    pump(root, 2 * load.this.ui.interval / 1000)  # let posted UI updates run
+
+
+def play(record, load, journalDir):
+    if record['kind'] == 'journal':
+        entry = record['entry']
+        for name, contents in record.get('files', {}).items():
+            with open(os.path.join(journalDir, name), 'w', encoding='utf-8') as journalFile:
+                journalFile.write(contents)
+        load.journal_entry('Replay', False, entry.get('StarSystem'), entry.get('StationName'), entry, {})
+    elif record['kind'] == 'click':
+        if record['state'] == 'showLoop':
+            if record['indx'] < len(load.this.shownLoops):
+                load.showLoop(record['indx'])
+        elif record['state'] == 'showRoute':
+            if record['indx'] < len(load.this.routes):
+                load.showRoute(record['indx'])
+        else:
+            load.load(record['state'])
+
+
+def replay(records, speed, cacheDir=None):
+    try:
+        root = tk.Tk()
+    except tk.TclError as err:
+        sys.exit(f'Replaying needs a display ({err}), try running it under xvfb-run')
+    root.withdraw()
+
+    pluginDir = tempfile.mkdtemp(prefix='trade-tracker-replay-')
+    journalDir = os.path.join(pluginDir, 'journal')
+    os.makedirs(journalDir)
+    if cacheDir:
+        shutil.copytree(cacheDir, os.path.join(pluginDir, 'cache'))
+    config.set('journaldir', journalDir)
+
+    server = recordedServer(records).start()
+    import load  # after the stubs are on the path and config is set
+    load.this.http = ReplayClient(server)
+    try:
+        load.plugin_start3(pluginDir)
+        load.plugin_app(root)
+        settle(root, load)
+        started = time.perf_counter()
+        for record in records:
+            if record['kind'] in HTTP_KINDS:
+                continue
+            if speed:
+                pump(root, started + record['at'] / speed - time.perf_counter())
+            play(record, load, journalDir)
+            if not speed:
+                settle(root, load)
+        settle(root, load)
+        seconds = time.perf_counter() - started
+    finally:
+        load.plugin_stop()
+        server.stop()
+        root.destroy()
+        shutil.rmtree(pluginDir, ignore_errors=True)
+    return seconds, len(server.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('session', help='session file written by SessionRecorder')
+    parser.add_argument('--speed', type=float, default=0, help='multiple of the recorded speed, 0 for as fast as possible')
+    parser.add_argument('--cache', help='cache folder to start from, a copy is used')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    records = readSession(args.session)
+    seconds, requests = replay(records, args.speed, args.cache)
+    summary = metrics.summary()
+    results = {'seconds': round(seconds, 3), 'requests': requests, 'spans': {}}
+    print(f'Replayed {sum(record["kind"] not in HTTP_KINDS for record in records)} records in {seconds:.1f}s, '
+          f'{requests} requests served')
+    print(f'{"span":<24}{"samples":>8}{"p50 ms":>10}{"p95 ms":>10}')
+    for name in REPORTED:
+        samples, p50, p95 = summary.get(name, (0, 0, 0))
+        results['spans'][name] = {'samples': samples, 'p50': round(p50, 6), 'p95': round(p95, 6)}
+        print(f'{name:<24}{samples:>8}{p50 * 1000:>10.1f}{p95 * 1000:>10.1f}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
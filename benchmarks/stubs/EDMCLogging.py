@@ -0,0 +1,6 @@
+"""Stand in for EDMC's EDMCLogging module so plugin modules can be imported outside EDMC"""
+import logging
+
+
+def get_main_logger():
+    return logging.getLogger('EDMC')
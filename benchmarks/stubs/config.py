@@ -0,0 +1,32 @@
+"""Stand in for EDMC's config module, settings live in a dict"""
+import os
+import tempfile
+
+appname = 'EDMarketConnector'
+
+
+class Config:
+    def __init__(self):
+        self.values = dict()
+        self.default_journal_dir = tempfile.gettempdir()
+
+    def get_int(self, key, default=0):
+        return int(self.values.get(key, default))
+
+    def get_str(self, key, default=None):
+        return self.values.get(key, default)
+
+    def get_bool(self, key, default=False):
+        return bool(self.values.get(key, default))
+
+    def get_list(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def delete(self, key, suppress=False):
+        self.values.pop(key, None)
+
+
+config = Config()
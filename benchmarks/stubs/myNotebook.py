@@ -0,0 +1,10 @@
+"""Stand in for EDMC's myNotebook module"""
+import tkinter as tk
+from tkinter import ttk
+
+Frame = ttk.Frame
+Label = ttk.Label
+Checkbutton = ttk.Checkbutton
+Entry = ttk.Entry
+Button = ttk.Button
+Notebook = ttk.Notebook
@@ -0,0 +1,12 @@
+"""Stand in for EDMC's theme module"""
+
+
+class Theme:
+    def register(self, widget):
+        pass
+
+    def update(self, widget):
+        pass
+
+
+theme = Theme()
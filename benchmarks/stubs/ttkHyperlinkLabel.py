@@ -0,0 +1,8 @@
+"""Stand in for EDMC's ttkHyperlinkLabel module"""
+from tkinter import ttk
+
+
+class HyperlinkLabel(ttk.Label):
+    def __init__(self, master=None, url=None, underline=None, background=None, **kw):
+        self.url = url
+        super().__init__(master, **kw)
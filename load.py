@@ -2,9 +2,10 @@ import os
 import sys
 import logging
 import tkinter as tk
+import queue
 import threading
-import requests
 import json
+import time
 import traceback
 from functools import partial
 
@@ -13,6 +14,18 @@ from functools import partial
 import Helpers
 from Views import *
 from Models import *
+from Cache import CommodityCache, LoopCache
+from Search import LoopSearch
+from Network import HttpClient
+import Journal
+from Metrics import metrics, Stopwatch
+from Store import MarketStore
+from Snapshot import Snapshot
+from Sync import ListingSync
+from Tracking import RouteTracker
+from Lookup import CommodityLookup, StationLookup
+from Session import SessionRecorder
+from Scoring import LoopScores, ScoringSettings
 
 
 # EDMC imports
@@ -32,14 +45,59 @@ logger = logging.getLogger(f'{appname}.{plugin_name}')
 
 # Page Vars
 this.currentPage = None
+this.searchStarted = None  # when "Loop Route" was clicked, for timing
+this.ui = UiQueue()  # workers post UI updates here, they run on the Tk thread
 
 # Loop Vars
-this.shouldFetchLoop = threading.Event()
+this.loopScheduler = Helpers.SearchScheduler()
 this.fetchedCommodities = threading.Event()
 this.loops = []
-this.shownLoops = []
+this.shownLoops = []  # LoopInfoLines on the loops page, refilled for each page
+this.ranking = LoopRanking([])  # this.loops ordered by the selected sort
+this.scores = LoopScores([])  # this.loops as columns, scored again when the ship changes
+this.loopPage = 0
 this.commoditiesDict = dict()
+this.commodityLookup = CommodityLookup()  # rebuilt with this.commoditiesDict, for journal events
+this.stationLookup = StationLookup()  # station ids by MarketID and name, for Docked events
 this.currentLoop = None
+this.tracker = None  # RouteTracker for the selected loop, only used on the Tk thread
+this.loopSearch = LoopSearch()  # local engine, used when we hold market data for the current system
+this.loopCache = None
+this.shownSearch = ([], None)  # (this.loops, the search settings they came from), swapped together on the Tk thread
+this.searchLock = threading.Lock()  # held while this.loopSearch is being searched or updated
+this.store = None  # MarketStore holding every system, station and listing we know about
+this.localAreaRadius = 150  # ly around the current system loaded from the store for local searches
+this.snapshot = None  # memory mapped copy of the store's systems and stations, see Snapshot.py
+this.snapshotLock = threading.Lock()  # held while this.snapshot is read or swapped
+this.snapshotMaxAge = 86400  # seconds before the snapshot is written again from the store
+
+# Prefetch Vars
+this.prefetcher = None  # searches run ahead of a click, None when prefetching is turned off
+this.prefetchSettings = None  # search settings read on the Tk thread for the prefetch worker
+this.prefetchMaxDefer = 10  # seconds a prefetch waits for a search the user is waiting on
+
+# Journal Vars
+this.currentSystemId = None  # store id of the current system, negative when eddb doesn't know it (see searchSystemId)
+this.dockedStation = None
+this.marketEvents = queue.Queue()
+
+this.loopsShown = 5  # number of loops shown on the loops page
+this.routes = []  # Route stop lists shown on the routes page
+this.streamChunkSize = 64 * 1024
+
+# Network Vars
+this.http = HttpClient()  # every network call goes through this so connections are reused
+
+# Listing Sync Vars
+LISTINGS_URL = 'https://eddb.io/archive/v6/listings.csv'
+this.listingSync = None
+
+# Session Vars
+this.recorder = None  # SessionRecorder when Trade-Tracker_recordSession is on, replay with benchmarks/replay.py
+
+# Commodity Vars
+COMMODITIES_URL = 'https://eddb.io/archive/v6/commodities.json'
+this.commodityCache = None
 
 # For compatibility with pre-5.0.0
 if not hasattr(config, 'get_int'):
@@ -54,6 +112,26 @@ if not hasattr(config, 'get_list'):
 # EDMC Funcs
 def plugin_start3(plugin_dir):
     """Start the plugin"""
+    this.pluginDir = plugin_dir
+    loadCachedCommodities()
+    this.loopCache = LoopCache(
+        ttl=config.get_int("Trade-Tracker_loopCacheTtl", default = 300),
+        maxEntries=config.get_int("Trade-Tracker_loopCacheSize", default = 32),
+        path=os.path.join(this.pluginDir, 'cache', 'loops.json') if config.get_int("Trade-Tracker_loopCacheDisk", default = 1) else None
+    )
+    this.loopCache.load()
+    this.store = MarketStore(os.path.join(this.pluginDir, 'cache', 'market.db'))
+    this.snapshot = Snapshot.open(os.path.join(this.pluginDir, 'cache', 'systems.snapshot'))
+    this.listingSync = ListingSync(this.store, this.http)
+    if config.get_int("Trade-Tracker_recordSession", default = 0):
+        this.recorder = SessionRecorder(os.path.join(this.pluginDir, 'cache', 'sessions', time.strftime('%Y%m%d-%H%M%S') + '.jsonl'))
+        this.http.recorder = this.recorder
+    if config.get_int("Trade-Tracker_prefetch", default = 1):
+        this.prefetcher = Helpers.Prefetcher(
+            budget=config.get_int("Trade-Tracker_prefetchBudget", default = 10),
+            window=this.loopCache.ttl
+        )
+
     logger.info('Starting worker threads...')
     this.stopThreads = threading.Event()
     this.threads = [
@@ -68,8 +146,29 @@ def plugin_start3(plugin_dir):
             args=(this.stopThreads, ),
             name='Commodity Update Worker',
             daemon=True
+        ),
+        threading.Thread(
+            target=marketThread,
+            args=(this.stopThreads, ),
+            name='Market Update Worker',
+            daemon=True
         )
     ]
+    if this.prefetcher:
+        this.threads.append(threading.Thread(
+            target=prefetchThread,
+            args=(this.stopThreads, ),
+            name='Loop Prefetch Worker',
+            daemon=True
+        ))
+    syncInterval = config.get_int("Trade-Tracker_listingSyncInterval", default = 0)  # seconds, 0 turns syncing off
+    if syncInterval:
+        this.threads.append(threading.Thread(
+            target=listingSyncThread,
+            args=(this.stopThreads, syncInterval),
+            name='Listing Sync Worker',
+            daemon=True
+        ))
     [thread.start() for thread in this.threads] # start all the threads
     logger.debug('Done.')
     loadConfigVars()
@@ -79,6 +178,7 @@ def plugin_start3(plugin_dir):
 def plugin_app(parent):
     # Adds to the main page UI
     this.frame = tk.Frame(parent)
+    this.ui.start(this.frame)
     initPages()
     load("home")
     return this.frame
@@ -95,6 +195,17 @@ def plugin_prefs(parent, cmdr, is_beta):
         frame, text='Trade Tracker', background=nb.Label().cget('background'), url="https://github.com/Typhoone/route-tracker", underline=True
     ).grid(row = 0, columnspan=2, padx=x_padding, sticky=tk.W) 
 
+    # Recent timings, so a slow "Loading..." can be tracked down
+    nb.Label(frame, text='Recent timings (p50 / p95)').grid(row = 1, columnspan=2, padx=x_padding, pady=(10, 0), sticky=tk.W)
+    row = 2
+    for name, (samples, p50, p95) in sorted(metrics.summary().items()):
+        nb.Label(frame, text=name).grid(row = row, column = 0, padx=x_padding, sticky=tk.W)
+        nb.Label(frame, text=f'{p50 * 1000:.0f}ms / {p95 * 1000:.0f}ms ({samples})').grid(row = row, column = 1, sticky=tk.W)
+        row = row + 1
+    for name, value in sorted(metrics.counters.items()):
+        nb.Label(frame, text=name).grid(row = row, column = 0, padx=x_padding, sticky=tk.W)
+        nb.Label(frame, text=str(value)).grid(row = row, column = 1, sticky=tk.W)
+        row = row + 1
 
     return frame
 
@@ -103,10 +214,37 @@ def plugin_stop() -> None:
     logger.debug('Signalling threads to stop...')
     # Signal threads to close and wait for them to stop
     this.stopThreads.set()
+    this.loopScheduler.stop()
+    this.marketEvents.put(None)
+    if this.prefetcher:
+        this.prefetcher.stop()
+    this.http.close()  # cancels any retry that is waiting
+    with this.snapshotLock:
+        if this.snapshot:
+            this.snapshot.close()
+            this.snapshot = None
     [thread.join() for thread in this.threads]
     this.threads = None
+    this.loopCache.save()  # puts only save every so often, write the latest searches
+    if this.recorder:
+        this.recorder.close()
+        this.recorder = None
     logger.debug('Done.')
 
+def journal_entry(cmdr, is_beta, system, station, entry, state):
+    """Follow the commander around and pick up the markets they dock at"""
+    event = entry['event']
+    if this.recorder:
+        this.recorder.journal(entry, config.get_str('journaldir') or config.default_journal_dir)
+    if event == 'Loadout':
+        changeShip(entry)
+    if this.tracker and this.tracker.handle(entry):
+        this.trackingView.setStatus(this.tracker.statusText())
+    if event in ('Location', 'FSDJump', 'CarrierJump', 'FSDTarget', 'NavRoute') and this.prefetcher:
+        this.prefetchSettings = loopSearchParams()  # the settings are Tk variables, so read them here
+    if event in ('Location', 'FSDJump', 'CarrierJump', 'Docked', 'Market', 'FSDTarget', 'NavRoute'):
+        this.marketEvents.put((time.perf_counter(), entry))
+
 # Paging
 
 def initPages():
@@ -114,7 +252,8 @@ def initPages():
 
     # Home
     loop_btn = tk.Button(this.frame, text="Loop Route", command= lambda : load("loadLoops"))
-    buttons = [loop_btn]
+    route_btn = tk.Button(this.frame, text="Multi-Hop Route", command= lambda : load("loadRoutes"))
+    buttons = [loop_btn, route_btn]
     this.pages["home"] = HomeView(buttons)
 
     # Loading Page
@@ -122,10 +261,17 @@ def initPages():
     this.pages['loading'] = LoadingView(loadingLabel)
 
     # Loops Page
-    this.pages['loops'] = LoopsView()
+    this.pages['loops'] = LoopsView(this.frame, this.loopsShown, {name: sort[0] for name, sort in LOOP_SORTS.items()},
+                                    this.loopSort, changeLoopPage, changeLoopSort)
+
+    # Routes Page
+    this.pages['routes'] = RoutesView(this.frame, showRoute, lambda : load("home"))
 
     # Loop Page
 
+    # Route tracking status, shown under the pages while a loop is tracked
+    this.trackingView = TrackingView(this.frame, stopTracking)
+
     # Test Page
     category = Category(5, "test")
     categories = [category]
@@ -142,13 +288,22 @@ def showPage(page, includeFooter = False):
 
 def load(state):
     this.state = state
+    if this.recorder and state in ('loadLoops', 'loadRoutes'):
+        this.recorder.click(state)
     if state == 'home':
         showPage(state)
     elif state == 'loadLoops':
         showPage('loading')
-        this.shouldFetchLoop.set()
+        this.searchStarted = time.perf_counter()
+        this.loopScheduler.submit(loopSearchParams())
     elif state == 'loops':
         showPage('loops')
+    elif state == 'loadRoutes':
+        showPage('loading')
+        this.searchStarted = time.perf_counter()
+        this.loopScheduler.submit(routeSearchParams())
+    elif state == 'routes':
+        showPage('routes')
 
 def tester():
     logger.info("Working")
@@ -162,6 +317,11 @@ def loadConfigVars():
 	this.minDemandInt = tk.IntVar(value=config.get_int("Trade-Tracker_minDemand", default = 0))
 	this.minProfitInt = tk.IntVar(value=config.get_int("Trade-Tracker_minProfit", default = 20000))
 
+	this.loopSort = config.get_str("Trade-Tracker_loopSort", default = 'profit')
+
+	this.cargoCapacity = config.get_int("Trade-Tracker_cargoCapacity", default = 0)  # from the last Loadout
+	this.jumpRange = float(config.get_str("Trade-Tracker_jumpRange", default = '0'))
+
 	this.currentSystem = config.get_str("Trade-Tracker_CurrentSystem", default = 'Sol')
 
 	this.currentStation = config.get_str("Trade-Tracker_CurrentStation", default = "Abraham Lincoln")
@@ -202,84 +362,515 @@ def lookupLoops(minSupply, systemId, includePlanetary, hopDist=50, priceAge=30,
     jsonOb = json.dumps(postData, indent = 4)
     logger.debug(jsonOb)
     logger.debug("Begin Fetch")
-    jsonData = requests.post(url, json=postData).json()
+    with metrics.span('loops.request'):
+        response = this.http.post(url, json=postData, stream=True)
+    response.raise_for_status()
+
+    # Loops are yielded as they are decoded so the best ones can be shown before the rest arrive
+    download = Stopwatch()
+    decode = Stopwatch()
+    build = 0
+    chunks = download.wrap(metrics.countBytes('bytes.downloaded', response.iter_content(this.streamChunkSize)))
+    for loop in decode.wrap(Helpers.iterJsonArray(chunks)):
+        start = time.perf_counter()
+        newLoop = Loop(**loop)
+        build = build + time.perf_counter() - start
+        metrics.count('loops.parsed')
+        yield newLoop
+    metrics.record('loops.download', download.seconds)
+    metrics.record('loops.decode', decode.seconds - download.seconds)
+    metrics.record('loops.build', build)
     logger.debug("End Fetch")
 
-    # logger.debug(jsonData)
+def searchLoops(minSupply, systemId, includePlanetary, hopDist=50, priceAge=30, minDemand=0, minProfit=9500):
+    """Search the local market data if it covers the system, otherwise fall back to eddb.
 
-    loops = []
-
-    for loop in jsonData:
-        newLoop = Loop(**loop) 
-        loops.append(newLoop)
+    Returns an iterable of loops ordered by profit.
+    """
+    if not this.loopSearch.hasSystem(systemId):
+        return lookupLoops(minSupply, systemId, includePlanetary, hopDist, priceAge, minDemand, minProfit)
 
+    logger.debug("Begin Local Search")
+    with this.searchLock, metrics.span('loops.localSearch'):
+        loops = searchLocal(this.loopSearch, minSupply, systemId, includePlanetary, hopDist, priceAge, minDemand, minProfit)
+    logger.debug("End Local Search")
     return loops
 
-def updateLoops(loops):
-    loopNum = 5
-    loopsToProcess = loops[:loopNum]
+def searchLocal(loopSearch, minSupply, systemId, includePlanetary, hopDist=50, priceAge=30, minDemand=0, minProfit=9500):
+    """Run a search with the same settings as searchLoops on a local engine"""
+    loopSearch.commodities = this.commoditiesDict
+    return loopSearch.search(systemId,
+                             hopDistance=hopDist,
+                             minSupply=minSupply,
+                             minDemand=minDemand,
+                             priceAge=priceAge,
+                             minProfit=minProfit,
+                             includePlanetary=includePlanetary
+                             )
+
+def renderLoops(loops, params, show=True, eventTime=None):
+    """Update the loops page and switch to it if `show`, only call this on the Tk thread (see this.ui)
+
+    `params` are the search settings the loops came from and `eventTime` is when the
+    journal event that caused the update was queued, if one did.
+    """
+    this.loops = loops
+    this.shownSearch = (loops, params)
+    with metrics.span('loops.score'):
+        this.scores = LoopScores(loops)
+        this.scores.apply(scoringSettings())
+    this.ranking = LoopRanking(loops, this.loopSort)
+    if this.currentPage != 'loops':
+        this.loopPage = 0  # a new search starts on the first page, a refresh keeps the page
+    with metrics.span('ui.render'):
+        updateLoops()
+    if show:
+        load("loops")
+        if this.searchStarted:
+            metrics.record('loops.clickToRender', time.perf_counter() - this.searchStarted)
+            this.searchStarted = None
+    if eventTime:
+        metrics.record('loops.eventToRender', time.perf_counter() - eventTime)
+
+def updateLoops():
+    """Fill the loop lines with the current page of this.ranking"""
+    pageCount = this.ranking.pageCount(this.loopsShown)
+    this.loopPage = min(this.loopPage, pageCount - 1)
+    loopsToProcess = this.ranking.page(this.loopPage, this.loopsShown)
+    offset = this.loopPage * this.loopsShown
     for indx, loop in enumerate(loopsToProcess):
-        logger.debug(loop.oneStation.type_id)
-        logger.debug(loop.twoStation.type_id)
-        showLoopFunc = partial(showLoop, indx)
         if indx < len(this.shownLoops):
-            # update loop
-            this.shownLoops[indx].updateLine(loop, indx, showLoopFunc)
+            # update loop, the button of each line always selects the loop on that line
+            line = this.shownLoops[indx]
+            line.updateLine(loop, str(offset + indx + 1), line.buttonFunc)
         else:
             # create loop and append
-            loopInfoLine = LoopInfoLine(loop, this.frame, str(indx + 1), showLoopFunc)
+            loopInfoLine = LoopInfoLine(loop, this.pages['loops'].frame, str(offset + indx + 1), partial(showLoop, indx))
             this.shownLoops.append(loopInfoLine)
-    this.pages['loops'].setLoops(this.shownLoops)
-   
+    this.pages['loops'].setLoops(this.shownLoops, len(loopsToProcess))
+    this.pages['loops'].setPage(this.loopPage, pageCount)
+
+def changeLoopPage(step):
+    this.loopPage = max(0, this.loopPage + step)
+    updateLoops()
+
+def changeLoopSort(sort):
+    this.loopSort = sort
+    config.set("Trade-Tracker_loopSort", sort)
+    this.ranking = LoopRanking(this.loops, sort)
+    this.loopPage = 0
+    updateLoops()
+
+def scoringSettings():
+    return ScoringSettings(
+        cargoCapacity=this.cargoCapacity,
+        jumpRange=this.jumpRange,
+        halfLife=config.get_int("Trade-Tracker_priceHalfLife", default = 24)
+    )
+
+def changeShip(entry):
+    """Score the shown loops again for the ship in a Loadout event, nothing is fetched"""
+    cargoCapacity = entry.get('CargoCapacity', 0)
+    jumpRange = round(entry.get('MaxJumpRange', 0), 2)
+    if (cargoCapacity, jumpRange) == (this.cargoCapacity, this.jumpRange):
+        return
+    this.cargoCapacity = cargoCapacity
+    this.jumpRange = jumpRange
+    config.set("Trade-Tracker_cargoCapacity", cargoCapacity)
+    config.set("Trade-Tracker_jumpRange", str(jumpRange))
+    logger.info(f'Scoring loops for {cargoCapacity}t cargo and {jumpRange}ly jumps')
+    with metrics.span('loops.score'):
+        this.scores.apply(scoringSettings())
+    if this.loops:
+        this.ranking = LoopRanking(this.loops, this.loopSort)
+        updateLoops()
+
 def showLoop(indx):
-    this.currentLoop = this.loops[indx]
+    if this.recorder:
+        this.recorder.click('showLoop', indx=indx)
+    this.currentLoop = this.shownLoops[indx].loop
     logger.debug(this.currentLoop)
+    startTracking(this.currentLoop.route())
+
+def startTracking(stops):
+    this.tracker = RouteTracker(stops, this.commodityLookup)
+    this.trackingView.setStatus(this.tracker.statusText())
+    this.trackingView.show()
+
+def stopTracking():
+    this.tracker = None
+    this.trackingView.hide()
+
+def loadCachedCommodities():
+    """Load the commodity catalogue from disk so loops can be fetched straight away"""
+    this.commodityCache = CommodityCache(os.path.join(this.pluginDir, 'cache', 'commodities.json'))
+    commodities = this.commodityCache.load()
+    if commodities:
+        this.commoditiesDict = commodities
+        this.commodityLookup = CommodityLookup(commodities.values())
+        this.fetchedCommodities.set()
+        logger.info(f"Loaded {len(commodities)} cached commodities")
 
 # Thread Stuff
 def fetchCommodities(stopThread):
-    """Worker thread for fetching commodities"""
-    logger.debug("Fetching cmmodities...")
+    """Worker thread for fetching commodities, revalidates the cached catalogue if there is one"""
+    logger.debug("Fetching commodities...")
     try:
-        for commodity in requests.get('https://eddb.io/archive/v6/commodities.json').json():
-            newCommodity = Commodity(**commodity)
-            this.commoditiesDict[newCommodity.id] = newCommodity
-        logger.info(f"Fetched {len(commoditiesDict)} commodities")
+        with metrics.span('commodities.request'):
+            response = this.http.get(COMMODITIES_URL, headers=this.commodityCache.headers(), stream=True)
+        with response:  # a 304 has no body to read, the connection goes back to the pool when it's closed
+            if response.status_code == 304:
+                logger.info("Cached commodities are up to date")
+            else:
+                response.raise_for_status()
+                commodities = dict()
+                chunks = metrics.countBytes('bytes.downloaded', response.iter_content(this.streamChunkSize))
+                for commodity in Helpers.iterJsonArray(chunks):
+                    newCommodity = Commodity(**commodity)
+                    commodities[newCommodity.id] = newCommodity
+                this.commoditiesDict = commodities
+                this.commodityLookup = CommodityLookup(commodities.values())
+                logger.info(f"Fetched {len(commodities)} commodities")
+                this.commodityCache.save(commodities.values(), response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                this.store.upsertCommodities(commodities.values())
         this.fetchedCommodities.set()
     except Exception as err:
         logger.error(err)
         logger.error(traceback.format_exc())
 
+def loopSearchParams():
+    """The current loop search settings as keyword arguments for searchLoops"""
+    # systemId = getSystemId(this.currentSystem) if this.currentSystem else 17072
+    return {
+        'minSupply': round(this.minSupplyInt.get() * 640),
+        'systemId': searchSystemId(),
+        'includePlanetary': this.includePlanetary.get() == 1,
+        'hopDist': 23,
+        'priceAge': this.priceAgeInt.get(),
+        'minDemand': this.minDemandInt.get(),
+        'minProfit': this.minProfitInt.get()
+    }
+
+def routeSearchParams():
+    """The loop search settings plus the route planner's, fetchRoutes runs searches that have 'hops'"""
+    return {
+        **loopSearchParams(),
+        'hops': config.get_int("Trade-Tracker_routeHops", default = 4),
+        'roundTrip': config.get_int("Trade-Tracker_routeRoundTrip", default = 1) == 1
+    }
+
+def searchSystemId():
+    """Id of the current system to search around, local ids are only any good to the local search"""
+    systemId = this.currentSystemId
+    if systemId is None or (systemId < 0 and not this.loopSearch.hasSystem(systemId)):
+        return 17072  # Sol, when we don't know where we are
+    return systemId
+
+def fetchLoops(params, generation):
+    """Show loops for the search settings, from the cache if a recent search matches.
+
+    Stops early without showing anything once a newer search has been requested.
+    """
+    isCurrent = lambda: this.loopScheduler.isCurrent(generation)
+    key = LoopCache.key(params)
+    cached = this.loopCache.get(key, params['priceAge'])
+    metrics.count('cache.hit' if cached else 'cache.miss')
+    if cached:
+        cachedLoops, fresh = cached
+        this.ui.post(partial(renderLoops, cachedLoops, params), key='loops')
+        if fresh:
+            logger.info("Using cached Loop Data")
+            return
+        logger.info("Cached Loop Data is stale, refreshing")
+
+    loops = []
+    for loop in searchLoops(**params):
+        if not isCurrent():
+            logger.info("Loop search superseded, dropping it")
+            return
+        loops.append(loop)
+        if len(loops) == this.loopsShown and not cached:  # show the best loops while the rest are still arriving
+            this.ui.post(partial(renderLoops, list(loops), params), key='loops')
+    logger.info("Loop Data Fetched")
+    metrics.logSummary()
+    this.loopCache.put(key, loops)
+    if not isCurrent():
+        return
+    this.ui.post(partial(renderLoops, loops, params), key='loops')
+
+def fetchRoutes(params, generation):
+    """Plan multi hop routes around the current system from the local market data"""
+    routes = []
+    with this.searchLock:
+        if this.loopSearch.hasSystem(params['systemId']):
+            this.loopSearch.commodities = this.commoditiesDict
+            routes = this.loopSearch.searchRoutes(params['systemId'], hops=params['hops'], roundTrip=params['roundTrip'],
+                                                  hopDistance=params['hopDist'], minSupply=params['minSupply'], minDemand=params['minDemand'],
+                                                  priceAge=params['priceAge'], minProfit=params['minProfit'],
+                                                  includePlanetary=params['includePlanetary'], limit=this.loopsShown)
+    logger.info(f'Planned {len(routes)} routes of {params["hops"]} hops')
+    if this.loopScheduler.isCurrent(generation):
+        this.ui.post(partial(renderRoutes, routes), key='routes')
+
+def renderRoutes(routes):
+    """Fill the routes page and switch to it, only call this on the Tk thread (see this.ui)"""
+    this.routes = routes
+    this.pages['routes'].setRoutes([routeText(route) for route in routes])
+    load("routes")
+    if this.searchStarted:
+        metrics.record('routes.clickToRender', time.perf_counter() - this.searchStarted)
+        this.searchStarted = None
+
+def showRoute(indx):
+    if this.recorder:
+        this.recorder.click('showRoute', indx=indx)
+    startTracking(this.routes[indx])
+
 def loopFetchThread(stopThread):
     logger.debug('Loop thread starting...')
+    while not stopThread.is_set():  # exit loop if the stopThread event is called
+        job = this.loopScheduler.next()  # wait for the newest search, None once stopped
+        if job is None:
+            break
+        generation, params = job
+        try:
+            logger.info("Fetching Loop Data")
+            # wait until commodity list is fetched at least once before fetching loops
+            while not this.fetchedCommodities.wait(1):
+                if stopThread.is_set():
+                    return
+            if this.loopScheduler.isCurrent(generation):
+                fetch = fetchRoutes if 'hops' in params else fetchLoops
+                fetch(params, generation)
+        except Exception as err:
+            logger.error(err)
+            logger.error(traceback.format_exc())
+
+def prefetch(systemId, system=None):
+    """Queue a search for `systemId` with the current settings so "Loop Route" finds it cached.
+
+    `system` is the store row of a system the local search doesn't cover yet, its area is
+    loaded into a separate engine so the current area isn't disturbed.
+    """
+    if not this.prefetcher or not this.prefetchSettings:
+        return
+    params = {**this.prefetchSettings, 'systemId': systemId}
+    if this.prefetcher.submit(LoopCache.key(params), (params, system)):
+        logger.debug(f'Queued loop prefetch for system {systemId}')
+
+def prefetchSystem(name):
+    """Prefetch a system we are heading to, if the store has market data around it"""
+    if name == this.currentSystem:
+        return
+    known = this.store.systemByName(name)
+    if known:
+        prefetch(known['id'], known)
+
+def prefetchLoops(params, system=None):
+    key = LoopCache.key(params)
+    cached = this.loopCache.get(key, params['priceAge'])
+    if cached and cached[1]:
+        metrics.count('prefetch.skipped')
+        return
+    with metrics.span('prefetch.search'):
+        area = None
+        if system is not None and not this.loopSearch.hasSystem(system['id']):
+            area = localArea((system['x'], system['y'], system['z']), system['id'])  # its own engine, ours stays on this system
+        if area is not None and area.hasSystem(system['id']):
+            loops = searchLocal(area, **params)
+        elif system is None or system['id'] > 0:
+            loops = list(searchLoops(**params))
+        else:
+            return  # eddb doesn't know the system, the click will search around Sol
+    metrics.count('prefetch.run')
+    logger.info(f"Prefetched {len(loops)} loops for system {params['systemId']}")
+    this.loopCache.put(key, loops)
+
+def prefetchThread(stopThread):
+    """Worker thread that runs prefetches when no search the user is waiting on is running"""
+    logger.debug('Prefetch thread starting...')
+    while not stopThread.is_set():
+        job = this.prefetcher.next()  # waits for a job within the budget, None once stopped
+        if job is None:
+            break
+        key, (params, system) = job
+        try:
+            deferred = time.monotonic()
+            while this.searchStarted is not None and time.monotonic() - deferred < this.prefetchMaxDefer:
+                if stopThread.wait(0.25):
+                    return
+            while not this.fetchedCommodities.wait(1):
+                if stopThread.is_set():
+                    return
+            prefetchLoops(params, system)
+        except Exception as err:
+            logger.error(err)
+            logger.error(traceback.format_exc())
+
+def listingSyncThread(stopThread, interval):
+    """Worker thread that applies the listings that changed since the last sync every `interval` seconds"""
+    logger.debug('Listing sync thread starting...')
+    while not stopThread.is_set():
+        try:
+            report = this.listingSync.sync(config.get_str("Trade-Tracker_listingSyncUrl", default = LISTINGS_URL),
+                                           config.get_int("Trade-Tracker_priceAge", default = 1))
+            if report.changed or report.pruned:
+                this.marketEvents.put((time.perf_counter(), {'event': 'ListingSync'}))
+        except Exception as err:
+            logger.error(err)
+            logger.error(traceback.format_exc())
+        stopThread.wait(interval)
+
+def marketThread(stopThread):
+    """Worker thread that applies journal events to the local market data"""
+    logger.debug('Market thread starting...')
     try:
-        stop_or_fetch = Helpers.OrEvent(stopThread, this.shouldFetchLoop)
-        while not stopThread.is_set():  # exit loop if the stopThread event is called
-            if this.shouldFetchLoop.is_set():
-                this.shouldFetchLoop.clear()
-                logger.info("Fetching Loop Data")
-                this.fetchedCommodities.wait() # wait until commodity list is fetched at least once before fetching loops
-                # systemId = getSystemId(this.currentSystem) if this.currentSystem else 17072
-                systemId = 17072
-
-                # logger.info(f'Fetching Loop Data - {systemId}: {this.currentSystem}')
-                maxHopDist = 23
-                minSup = round(this.minSupplyInt.get() * 640)
-                includePlanet = this.includePlanetary.get() == 1
-                this.loops = lookupLoops(minSup, 
-											systemId, 
-											includePlanet, 
-											maxHopDist, 
-											this.priceAgeInt.get(), 
-											this.minDemandInt.get(), 
-											this.minProfitInt.get()
-											)
-                logger.info("Loop Data Fetched")
-                # for loop in this.loops:
-                #     logger.debug(loop.profit())
-                # showPage(this.currentPage)
-                updateLoops(this.loops)
-                load("loops")
-            stop_or_fetch.wait() # wait until either stopThread or shouldFetchLoop events fire
+        this.stationLookup = StationLookup(this.store.stationNames())
+        refreshSnapshot()
     except Exception as err:
         logger.error(err)
-        logger.error(traceback.format_exc())
\ No newline at end of file
+        logger.error(traceback.format_exc())
+    while not stopThread.is_set():
+        item = this.marketEvents.get()
+        if item is None:
+            break
+        queuedAt, entry = item
+        try:
+            handleMarketEvent(entry, queuedAt)
+            metrics.record('journal.eventToUpdate', time.perf_counter() - queuedAt)
+        except Exception as err:
+            logger.error(err)
+            logger.error(traceback.format_exc())
+        finally:
+            this.marketEvents.task_done()  # lets benchmarks/replay.py tell when the queue is worked through
+
+def refreshSnapshot():
+    """Write the snapshot again if it is missing or old, readers use the store while it is written"""
+    snapshot = this.snapshot
+    if snapshot and time.time() - snapshot.createdAt < this.snapshotMaxAge:
+        return
+    if not this.store.query('SELECT id FROM systems LIMIT 1'):
+        return
+    with this.snapshotLock:
+        this.snapshot = None
+        if snapshot:
+            snapshot.close()  # the file can't be replaced while it is mapped on Windows
+    path = os.path.join(this.pluginDir, 'cache', 'systems.snapshot')
+    with metrics.span('snapshot.write'):
+        this.store.writeSnapshot(path)
+    with this.snapshotLock:
+        this.snapshot = Snapshot.open(path)
+
+def storeArea(point, radius):
+    """Systems, stations and listings within `radius` of `point`.
+
+    Systems and stations come from the snapshot when there is one, with any the journal
+    added or changed since it was written taken from the store.
+    """
+    with this.snapshotLock:
+        if this.snapshot is None:
+            return this.store.area(point, radius)
+        with metrics.span('snapshot.area'):
+            systems, stations = this.snapshot.area(point, radius)
+        since = this.snapshot.createdAt
+    systems = {system['id']: system for system in systems}
+    systems.update((system['id'], system) for system in this.store.systemsNear(point, radius, since))
+    stations = {station['id']: station for station in stations}
+    stations.update((station['id'], station) for station in this.store.stationsInSystems(systems, since))
+    listings = this.store.listingsForStations(stations)
+    return list(systems.values()), list(stations.values()), listings
+
+def localArea(point, systemId):
+    """A LoopSearch of the store's market data around a system, None if there is nothing to trade with there.
+
+    The system is only covered, so searches there skip eddb, once a stations dump has been
+    imported. Until then the store only has the stations docked at, which are good for
+    repricing loops but are a few of the markets around.
+    """
+    systems, stations, listings = storeArea(point, this.localAreaRadius)
+    if len(stations) < 2:
+        return None
+    coverage = {systemId} if this.store.importedAt('stations') else set()
+    search = LoopSearch()
+    search.load(systems, stations, listings, this.commoditiesDict, coverage=coverage)
+    return search
+
+def useLoopSearch(search):
+    """Swap in a LoopSearch built by localArea, call with this.searchLock held"""
+    search.nextLoopId = this.loopSearch.nextLoopId
+    search.nextListingId = this.loopSearch.nextListingId  # listings made up from the journal keep unique ids
+    this.loopSearch = search
+
+def handleMarketEvent(entry, queuedAt=None):
+    event = entry['event']
+    if event in ('Location', 'FSDJump', 'CarrierJump'):
+        known = this.store.systemByAddress(entry.get('SystemAddress')) or this.store.systemByName(entry['StarSystem'])
+        system = Journal.systemFromEntry(entry, known['id'] if known else this.store.localId('systems'))
+        this.store.upsertSystems([system])
+        area = localArea((system.x, system.y, system.z), system.id)  # built before taking the lock, a click needn't wait
+        with this.searchLock:
+            if area:
+                useLoopSearch(area)
+            else:
+                this.loopSearch.updateSystem(system)
+            this.currentSystemId = system.id
+        this.currentSystem = entry['StarSystem']
+        config.set("Trade-Tracker_CurrentSystem", this.currentSystem)
+        prefetch(searchSystemId())  # the same search "Loop Route" would run here
+        if entry.get('Docked'):
+            handleMarketEvent({**entry, 'event': 'Docked'}, queuedAt)
+    elif event == 'ListingSync':
+        # listings in the store changed, the local search holds a copy of the ones around us
+        this.loopCache.clear()
+        rows = this.store.query('SELECT * FROM systems WHERE id = ?', (this.currentSystemId, )) if this.currentSystemId else []
+        area = localArea((rows[0]['x'], rows[0]['y'], rows[0]['z']), rows[0]['id']) if rows else None
+        if area:
+            with this.searchLock:
+                useLoopSearch(area)
+    elif event == 'FSDTarget':
+        prefetchSystem(entry['Name'])
+    elif event == 'NavRoute':
+        if not config.get_int("Trade-Tracker_prefetchRoute", default = 1):
+            return
+        route = Journal.readNavRoute(config.get_str('journaldir') or config.default_journal_dir)
+        nextJump = next((stop for stop in route if stop.get('StarSystem') != this.currentSystem), None)
+        if nextJump:
+            prefetchSystem(nextJump['StarSystem'])
+    elif event == 'Docked':
+        with this.searchLock:
+            systemId = this.loopSearch.systemId(entry['StarSystem'])
+            if systemId is None:
+                return  # we haven't seen the system's coordinates yet
+            knownId = this.stationLookup.find(entry['MarketID'], entry['StarSystem'], entry['StationName'])
+            if knownId is None:
+                knownId = this.store.localId('stations')
+            this.dockedStation = Journal.stationFromEntry(entry, systemId, knownId)
+            this.dockedStation.id = this.loopSearch.updateStation(this.dockedStation)
+        this.store.upsertStations([this.dockedStation])
+        this.stationLookup.add(this.dockedStation.id, entry['MarketID'], entry['StarSystem'], entry['StationName'])
+        this.currentStation = entry['StationName']
+        config.set("Trade-Tracker_CurrentStation", this.currentStation)
+    elif event == 'Market':
+        station = this.dockedStation
+        if not station or station.ed_market_id != entry['MarketID']:
+            return
+        market = Journal.readMarket(config.get_str('journaldir') or config.default_journal_dir)
+        if not market or market.get('MarketID') != entry['MarketID']:
+            return
+        this.commodityLookup.learnMarket(market)
+        listings = Journal.listingsFromMarket(market, station.id, this.commodityLookup)
+        with this.searchLock:
+            this.loopSearch.updateStation(station, listings)
+            listings = list(this.loopSearch.listings[station.id].values())  # now with ids
+            logger.info(f'Updated {len(listings)} listings for {station.name}')
+        this.store.replaceStationListings(station.id, listings)
+        shownLoops, params = this.shownSearch
+        if not shownLoops:
+            return
+        with this.searchLock:
+            this.loopSearch.commodities = this.commoditiesDict
+            fromSearch = bool(params) and this.loopSearch.hasSystem(params['systemId'])
+            loops = this.loopSearch.refreshStation(shownLoops, station.id, fromSearch)
+        if params:
+            this.loopCache.put(LoopCache.key(params), loops)
+        this.ui.post(partial(renderLoops, loops, params, False, queuedAt), key='loops')